@@ -6,17 +6,33 @@ import subprocess
 import shutil
 import logging
 import asyncio
-import requests
-from functools import wraps
-from flask import Flask, render_template, request, redirect, url_for, send_from_directory, jsonify, Response, session
+import zlib
+import base64
+import time
+import gzip
+import sqlite3
+import struct
+from functools import wraps, lru_cache
+from urllib.parse import quote
+from flask import Flask, render_template, request, redirect, url_for, send_from_directory, Response, session
 from werkzeug.utils import secure_filename
 from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_cors import CORS
-import yt_dlp
-from spotdl import Spotdl
-from spotdl.download.downloader import Downloader
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
+
+try:
+    import fcntl
+except ImportError:  # Windows ではプロセス内ロックのみ
+    fcntl = None
+
+# 任意: 高速 JSON / brotli 圧縮 (無ければ標準の json / gzip を使う)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 app = Flask(__name__)
 CORS(app)
@@ -24,18 +40,29 @@ CORS(app)
 app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
 
 # --- 設定 ---
-app.config['BASE_DIR'] = os.path.dirname(os.path.abspath(__file__))
+# MUSIC_SERVER_BASE_DIR でデータ置き場を差し替え可能 (ベンチマーク等)
+app.config['BASE_DIR'] = os.environ.get('MUSIC_SERVER_BASE_DIR') or os.path.dirname(os.path.abspath(__file__))
 app.config['MUSIC_FOLDER'] = os.path.join(app.config['BASE_DIR'], 'music')
 app.config['IMAGES_FOLDER'] = os.path.join(app.config['BASE_DIR'], 'images')
+app.config['HLS_FOLDER'] = os.path.join(app.config['BASE_DIR'], 'hls')
 app.config['DATA_FOLDER'] = os.path.join(app.config['BASE_DIR'], 'data')
 app.config['ARTISTS_FOLDER'] = os.path.join(app.config['DATA_FOLDER'], 'artists')
 app.config['ALBUMS_FOLDER'] = os.path.join(app.config['DATA_FOLDER'], 'albums')
 app.config['INDEX_FILE'] = os.path.join(app.config['DATA_FOLDER'], 'index.json')
+app.config['LOCK_FOLDER'] = os.path.join(app.config['DATA_FOLDER'], 'locks')
+app.config['LOCK_STRIPES'] = 256
+app.config['API_COMPRESS_MIN_SIZE'] = 1024
+app.config['JOB_DB'] = os.path.join(app.config['DATA_FOLDER'], 'jobs.sqlite3')
+app.config['JOB_MODE'] = os.environ.get('MUSIC_SERVER_JOB_MODE', 'thread')
 app.config['UPLOAD_TEMP'] = os.path.join(app.config['BASE_DIR'], 'temp_upload')
 app.config['SPOTDL_TEMP'] = os.path.join(app.config['BASE_DIR'], 'temp_spotdl')
 app.config['LOG_FILE'] = os.path.join(app.config['BASE_DIR'], 'server.log')
 app.config['KEY_FILE'] = os.path.join(app.config['BASE_DIR'], 'spotify_key.txt')
 
+# 変換後に HLS (セグメント分割) も書き出すか (長尺ミックス向け)
+app.config['HLS_ENABLED'] = os.environ.get('MUSIC_SERVER_HLS') == '1'
+app.config['HLS_SEGMENT_SECONDS'] = int(os.environ.get('MUSIC_SERVER_HLS_SEGMENT_SECONDS', 10))
+
 app.secret_key = 'super_secret_key_change_me'
 
 # --- 認証情報 ---
@@ -59,23 +86,34 @@ console.setFormatter(formatter)
 logging.getLogger('').addHandler(console)
 
 # --- 初期化 ---
-for folder in [app.config['MUSIC_FOLDER'], app.config['IMAGES_FOLDER'], app.config['DATA_FOLDER'], 
+# gunicorn の各ワーカーと worker.py が同時に import するので、作成は競合しても失敗しないようにする
+for folder in [app.config['MUSIC_FOLDER'], app.config['IMAGES_FOLDER'], app.config['HLS_FOLDER'], app.config['DATA_FOLDER'], 
                app.config['ARTISTS_FOLDER'], app.config['ALBUMS_FOLDER'], app.config['UPLOAD_TEMP'],
-               app.config['SPOTDL_TEMP']]:
-    if not os.path.exists(folder):
-        os.makedirs(folder)
+               app.config['SPOTDL_TEMP'], app.config['LOCK_FOLDER']]:
+    os.makedirs(folder, exist_ok=True)
 
 if not os.path.exists(app.config['INDEX_FILE']):
-    with open(app.config['INDEX_FILE'], 'w', encoding='utf-8') as f:
+    # 一時ファイルを書いてから link する (既にあれば他プロセスに任せる。書きかけの index は見せない)
+    _tmp = f"{app.config['INDEX_FILE']}.{uuid.uuid4().hex}.tmp"
+    with open(_tmp, 'w', encoding='utf-8') as f:
         json.dump([], f)
+    try: os.link(_tmp, app.config['INDEX_FILE'])
+    except FileExistsError: pass
+    finally: os.remove(_tmp)
+
+# --- Spotify クライアント ---
+# yt_dlp / spotdl / spotipy / requests は import が重いので、起動時には読み込まない。
+# クライアントも最初のインポート処理で必要になった時点で生成する (/stream や /api だけなら不要)。
 
-# --- Spotify APIキー読み込み ---
 SPOTIFY_CLIENT_ID = None
 SPOTIFY_CLIENT_SECRET = None
 sp_client = None
+spotify_search_client = None
+_spotify_init_lock = threading.Lock()
 
 def load_spotify_keys():
-    global SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET, sp_client
+    global SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET
+    if SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET: return True
     if os.path.exists(app.config['KEY_FILE']):
         try:
             with open(app.config['KEY_FILE'], 'r', encoding='utf-8') as f:
@@ -83,30 +121,47 @@ def load_spotify_keys():
                 if len(lines) >= 2:
                     SPOTIFY_CLIENT_ID = lines[0].strip()
                     SPOTIFY_CLIENT_SECRET = lines[1].strip()
-                    auth_manager = SpotifyClientCredentials(client_id=SPOTIFY_CLIENT_ID, client_secret=SPOTIFY_CLIENT_SECRET)
-                    sp_client = spotipy.Spotify(auth_manager=auth_manager)
-                    logging.info("Spotify keys loaded & Spotipy initialized.")
+                    logging.info("Spotify keys loaded.")
+                    return True
                 else:
                     logging.warning("spotify_key.txt format invalid (needs 2 lines).")
         except Exception as e:
             logging.error(f"Failed to load spotify_key.txt: {e}")
     else:
         logging.warning("spotify_key.txt not found.")
+    return False
 
-load_spotify_keys()
-
-# --- Global SpotDL Client (検索用) ---
-spotify_search_client = None
-if SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET:
-    try:
-        spotify_search_client = Spotdl(
-            client_id=SPOTIFY_CLIENT_ID, 
-            client_secret=SPOTIFY_CLIENT_SECRET, 
-            user_auth=False, 
-            headless=True
-        )
-    except Exception as e:
-        logging.error(f"Failed to initialize global SpotDL client: {e}")
+def get_spotipy_client():
+    """Spotipy クライアント (初回呼び出し時に生成)。キーが無ければ None"""
+    global sp_client
+    with _spotify_init_lock:
+        if sp_client is None and load_spotify_keys():
+            try:
+                import spotipy
+                from spotipy.oauth2 import SpotifyClientCredentials
+                auth_manager = SpotifyClientCredentials(client_id=SPOTIFY_CLIENT_ID, client_secret=SPOTIFY_CLIENT_SECRET)
+                sp_client = spotipy.Spotify(auth_manager=auth_manager)
+                logging.info("Spotipy initialized.")
+            except Exception as e:
+                logging.error(f"Failed to initialize Spotipy: {e}")
+        return sp_client
+
+def get_spotdl_instance():
+    """検索用 SpotDL クライアント (初回呼び出し時に生成、プロセスで 1 つ)。キーが無ければ None"""
+    global spotify_search_client
+    with _spotify_init_lock:
+        if spotify_search_client is None and load_spotify_keys():
+            try:
+                from spotdl import Spotdl
+                spotify_search_client = Spotdl(
+                    client_id=SPOTIFY_CLIENT_ID, 
+                    client_secret=SPOTIFY_CLIENT_SECRET, 
+                    user_auth=False, 
+                    headless=True
+                )
+            except Exception as e:
+                logging.error(f"Failed to initialize global SpotDL client: {e}")
+        return spotify_search_client
 
 # --- 認証・ヘルパー関数 ---
 
@@ -125,67 +180,226 @@ def requires_auth(f):
         return f(*args, **kwargs)
     return decorated
 
+# --- 排他制御 (スレッド間 + プロセス間) ---
+
+class ConflictError(Exception):
+    """読み込み後に他の書き込みが入った (楽観的排他制御の失敗)"""
+
+class EntityLock:
+    """ファイルロックによる排他。同一スレッド内では再入可能"""
+    def __init__(self, path):
+        self.path = path
+        self._rlock = threading.RLock()
+        self._depth = 0
+        self._fh = None
+
+    def __enter__(self):
+        self._rlock.acquire()
+        if self._depth == 0:
+            try:
+                self._fh = open(self.path, 'a')
+                if fcntl: fcntl.flock(self._fh.fileno(), fcntl.LOCK_EX)
+            except BaseException:
+                if self._fh: self._fh.close(); self._fh = None
+                self._rlock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            try:
+                if fcntl: fcntl.flock(self._fh.fileno(), fcntl.LOCK_UN)
+            finally:
+                self._fh.close(); self._fh = None
+        self._rlock.release()
+
+_entity_locks = {}
+_entity_locks_guard = threading.Lock()
+
+def entity_lock(kind, entity_id=None):
+    """
+    kind ('artist' / 'album' / 'index' ...) と ID からロックを取得する。
+    ロックファイルはID のハッシュで LOCK_STRIPES 個に分散させる。
+    複数取る場合の順序は artist -> album -> index に統一すること。
+    """
+    stripe = 0 if entity_id is None else zlib.crc32(str(entity_id).encode('utf-8')) % app.config['LOCK_STRIPES']
+    key = f"{kind}-{stripe:03d}"
+    with _entity_locks_guard:
+        lock = _entity_locks.get(key)
+        if lock is None:
+            lock = _entity_locks[key] = EntityLock(os.path.join(app.config['LOCK_FOLDER'], f"{key}.lock"))
+        return lock
+
+def dumps_json(data):
+    """UTF-8 のコンパクトな JSON (bytes)。orjson があればそちらを使う"""
+    if orjson: return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def loads_json(raw):
+    if orjson: return orjson.loads(raw)
+    return json.loads(raw)
+
+def write_json_atomic(path, data):
+    """一時ファイルに書いてから rename する (読み手が書きかけのファイルを見ない)"""
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(dumps_json(data))
+            f.flush(); os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp): os.remove(tmp)
+        raise
+
+def read_json(path):
+    if os.path.exists(path):
+        try:
+            with open(path, 'rb') as f: return loads_json(f.read())
+        except FileNotFoundError: return None
+    return None
+
+def bump_version(path, data):
+    """compare-and-swap: ディスク上の version が読み込み時と同じ場合のみ +1 する"""
+    current = read_json(path)
+    current_version = current.get('version', 0) if current else 0
+    if current_version != data.get('version', 0):
+        raise ConflictError(f"{os.path.basename(path)}: version {data.get('version', 0)} != {current_version}")
+    data['version'] = current_version + 1
+
+# --- データ操作 ---
+
 def load_index():
     try:
-        with open(app.config['INDEX_FILE'], 'r', encoding='utf-8') as f: return json.load(f)
+        with open(app.config['INDEX_FILE'], 'rb') as f: return loads_json(f.read())
     except: return []
 
 def save_index(data):
-    with open(app.config['INDEX_FILE'], 'w', encoding='utf-8') as f: json.dump(data, f, indent=4, ensure_ascii=False)
+    with entity_lock('index'):
+        write_json_atomic(app.config['INDEX_FILE'], data)
+
+def update_index(fn):
+    """index.json をロック下で読み込み→fn で変更した結果を保存"""
+    with entity_lock('index'):
+        save_index(fn(load_index()))
 
 def load_artist(artist_id):
-    path = os.path.join(app.config['ARTISTS_FOLDER'], f"{artist_id}.json")
-    if os.path.exists(path):
-        with open(path, 'r', encoding='utf-8') as f: return json.load(f)
-    return None
+    return read_json(os.path.join(app.config['ARTISTS_FOLDER'], f"{artist_id}.json"))
 
 def save_artist(data):
     path = os.path.join(app.config['ARTISTS_FOLDER'], f"{data['id']}.json")
-    with open(path, 'w', encoding='utf-8') as f: json.dump(data, f, indent=4, ensure_ascii=False)
-    idx = load_index()
-    summary = {
-        "id": data['id'], "name": data['name'], "genre": data.get('genre', ''),
-        "description": data.get('description', ''), "image": data.get('image', ''),
-        "album_count": len(data['albums'])
-    }
-    found = False
-    for i, item in enumerate(idx):
-        if item['id'] == data['id']:
-            idx[i] = summary; found = True; break
-    if not found: idx.append(summary)
-    save_index(idx)
+    with entity_lock('artist', data['id']):
+        bump_version(path, data)
+        write_json_atomic(path, data)
+        summary = {
+            "id": data['id'], "name": data['name'], "genre": data.get('genre', ''),
+            "description": data.get('description', ''), "image": data.get('image', ''),
+            "album_count": len(data['albums'])
+        }
+        if data.get('spotify_id'): summary['spotify_id'] = data['spotify_id']
+        def replace_summary(idx):
+            for i, item in enumerate(idx):
+                if item['id'] == data['id']:
+                    idx[i] = summary; return idx
+            idx.append(summary)
+            return idx
+        update_index(replace_summary)
+
+def update_artist(artist_id, fn):
+    """アーティストをロック下で読み込み→fn で変更→保存 (fn が False を返したら保存しない)"""
+    with entity_lock('artist', artist_id):
+        artist = load_artist(artist_id)
+        if artist is None: return None
+        if fn(artist) is False: return artist
+        save_artist(artist)
+        return artist
 
 def load_album(album_id):
-    path = os.path.join(app.config['ALBUMS_FOLDER'], f"{album_id}.json")
-    if os.path.exists(path):
-        with open(path, 'r', encoding='utf-8') as f: return json.load(f)
-    return None
+    return read_json(os.path.join(app.config['ALBUMS_FOLDER'], f"{album_id}.json"))
 
 def save_album(data):
     path = os.path.join(app.config['ALBUMS_FOLDER'], f"{data['id']}.json")
     if 'tracks' in data:
         data['tracks'].sort(key=lambda x: int(x.get('track_number', 0)))
-    with open(path, 'w', encoding='utf-8') as f: json.dump(data, f, indent=4, ensure_ascii=False)
+    with entity_lock('album', data['id']):
+        bump_version(path, data)
+        write_json_atomic(path, data)
+
+def update_album(album_id, fn):
+    """アルバムをロック下で読み込み→fn で変更→保存 (fn が False を返したら保存しない)"""
+    with entity_lock('album', album_id):
+        album = load_album(album_id)
+        if album is None: return None
+        if fn(album) is False: return album
+        save_album(album)
+        return album
+
+def find_track(album, track_id):
+    return next((t for t in album['tracks'] if t['id'] == track_id), None)
+
+def update_track(album_id, track_id, fn):
+    """update_album のトラック版。更新後のトラックを返す (アルバム/トラックが無ければ None)"""
+    result = {}
+    def apply(album):
+        target = find_track(album, track_id)
+        if target is None: return False
+        result['track'] = target
+        return fn(target)
+    update_album(album_id, apply)
+    return result.get('track')
 
 def delete_artist_data(artist_id):
-    artist = load_artist(artist_id)
-    if artist:
-        for alb in artist['albums']:
-            p = os.path.join(app.config['ALBUMS_FOLDER'], f"{alb['id']}.json")
+    with entity_lock('artist', artist_id):
+        artist = load_artist(artist_id)
+        if artist:
+            for alb in artist['albums']:
+                with entity_lock('album', alb['id']):
+                    p = os.path.join(app.config['ALBUMS_FOLDER'], f"{alb['id']}.json")
+                    if os.path.exists(p): os.remove(p)
+            p = os.path.join(app.config['ARTISTS_FOLDER'], f"{artist_id}.json")
             if os.path.exists(p): os.remove(p)
-        p = os.path.join(app.config['ARTISTS_FOLDER'], f"{artist_id}.json")
-        if os.path.exists(p): os.remove(p)
-    idx = load_index()
-    idx = [a for a in idx if a['id'] != artist_id]
-    save_index(idx)
+        update_index(lambda idx: [a for a in idx if a['id'] != artist_id])
 
 def delete_album_data(artist_id, album_id):
-    p = os.path.join(app.config['ALBUMS_FOLDER'], f"{album_id}.json")
-    if os.path.exists(p): os.remove(p)
-    artist = load_artist(artist_id)
-    if artist:
-        artist['albums'] = [a for a in artist['albums'] if a['id'] != album_id]
-        save_artist(artist)
+    with entity_lock('artist', artist_id):
+        with entity_lock('album', album_id):
+            p = os.path.join(app.config['ALBUMS_FOLDER'], f"{album_id}.json")
+            if os.path.exists(p): os.remove(p)
+        def drop(artist):
+            artist['albums'] = [a for a in artist['albums'] if a['id'] != album_id]
+        update_artist(artist_id, drop)
+
+# --- ファイル配置 (music/ ・ images/ ・ hls/ をハッシュで 2 階層に分割) ---
+# {uuid}.mp3 -> music/ab/cd/{uuid}.mp3 。URL やデータ上のファイル名は従来どおり。
+# 旧フラット配置のファイルも読めるので、migrate_storage.py で稼働中に移行できる。
+
+def shard_subdir(filename):
+    """ファイル名の先頭 4 文字 (16進) から 'ab/cd' を作る。該当しない名前は '' (フラット)"""
+    name = os.path.basename(filename)
+    prefix = name[:4].lower()
+    if len(name) <= 4 or any(c not in '0123456789abcdef' for c in prefix): return ''
+    return os.path.join(prefix[:2], prefix[2:])
+
+def storage_path(folder, filename, create=False):
+    """新規に書き込む場所 (シャード配置)"""
+    d = os.path.join(folder, shard_subdir(filename))
+    if create: os.makedirs(d, exist_ok=True)
+    return os.path.join(d, filename)
+
+def resolve_storage_path(folder, filename):
+    """既存ファイルの場所: シャード配置 -> 旧フラット配置 の順に探す"""
+    sharded = storage_path(folder, filename)
+    if os.path.exists(sharded): return sharded
+    flat = os.path.join(folder, filename)
+    if os.path.exists(flat): return flat
+    return sharded  # 移行中に移動された直後ならこちらにある
+
+def send_stored_file(folder, filename, **kwargs):
+    head, _, rest = filename.partition('/')
+    path = resolve_storage_path(folder, head)
+    rel = os.path.relpath(path, folder).replace(os.sep, '/')
+    return send_from_directory(folder, f"{rel}/{rest}" if rest else rel, **kwargs)
 
 def allowed_image(f): return '.' in f and f.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS_IMG
 def allowed_audio(f): return '.' in f and f.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS_AUDIO
@@ -194,16 +408,17 @@ def save_image_file(file):
     if file and allowed_image(file.filename):
         ext = file.filename.rsplit('.', 1)[1].lower()
         filename = f"{uuid.uuid4().hex}.{ext}"
-        file.save(os.path.join(app.config['IMAGES_FOLDER'], filename))
+        file.save(storage_path(app.config['IMAGES_FOLDER'], filename, create=True))
         return filename
     return None
 
 def download_image_from_url(url):
     try:
+        import requests
         resp = requests.get(url, stream=True)
         if resp.status_code == 200:
             filename = f"{uuid.uuid4().hex}.jpg"
-            path = os.path.join(app.config['IMAGES_FOLDER'], filename)
+            path = storage_path(app.config['IMAGES_FOLDER'], filename, create=True)
             with open(path, 'wb') as f:
                 resp.raw.decode_content = True
                 shutil.copyfileobj(resp.raw, f)
@@ -212,40 +427,153 @@ def download_image_from_url(url):
         logging.error(f"Image download failed: {e}")
     return None
 
-def process_upload_file(file):
-    filename = secure_filename(file.filename)
-    base_id = uuid.uuid4().hex
-    temp_path = os.path.join(app.config['UPLOAD_TEMP'], f"{base_id}_{filename}")
-    file.save(temp_path)
-    final_filename = f"{base_id}.mp3"
-    hq_path = os.path.join(app.config['MUSIC_FOLDER'], final_filename)
+def transcode_to_mp3(src_path):
+    """音声/動画ファイルを 320k MP3 に変換して music/ に置く。成功時はファイル名、失敗時は None"""
+    final_filename = f"{uuid.uuid4().hex}.mp3"
+    hq_path = storage_path(app.config['MUSIC_FOLDER'], final_filename, create=True)
     try:
-        subprocess.run(['ffmpeg', '-y', '-i', temp_path, '-b:a', '320k', '-map', 'a', hq_path],
+        subprocess.run(['ffmpeg', '-y', '-i', src_path, '-b:a', '320k', '-map', 'a', hq_path],
                        check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
     except Exception as e:
         logging.error(f"File convert error: {e}")
-        if os.path.exists(temp_path): os.remove(temp_path)
+        if os.path.exists(hq_path): os.remove(hq_path)
         return None
-    if os.path.exists(temp_path): os.remove(temp_path)
     return final_filename
 
+# --- 分割アップロード (tus 風: 作成 -> PATCH でオフセット指定の追記 -> 確定) ---
+# チャンクは temp_upload/<upload_id>.part に直接書き込み、メタ情報は <upload_id>.json に置く。
+
+def chunked_upload_paths(upload_id):
+    if not upload_id or any(c not in '0123456789abcdef' for c in upload_id): return None, None
+    base = os.path.join(app.config['UPLOAD_TEMP'], upload_id)
+    return f"{base}.part", f"{base}.json"
+
+def load_chunked_upload(upload_id):
+    """アップロード情報 (length / filename / offset)。存在しなければ None"""
+    part_path, info_path = chunked_upload_paths(upload_id)
+    if not part_path: return None
+    info = read_json(info_path)
+    if info is None or not os.path.exists(part_path): return None
+    info['offset'] = os.path.getsize(part_path)
+    return info
+
+def stage_upload_file(file):
+    """
+    フォームで受け取ったファイルを確定済みのアップロードとして temp_upload/ に置き、upload_id を返す。
+    変換は 'upload' ジョブ (worker.py) で行い、Web プロセスでは ffmpeg を動かさない。
+    """
+    upload_id = uuid.uuid4().hex
+    part_path, info_path = chunked_upload_paths(upload_id)
+    file.save(part_path)
+    write_json_atomic(info_path, {"id": upload_id, "length": os.path.getsize(part_path),
+                                  "filename": secure_filename(file.filename), "created": time.time(), "finalized": True})
+    return upload_id
+
+def delete_chunked_upload(upload_id):
+    for p in chunked_upload_paths(upload_id):
+        if p and os.path.exists(p): os.remove(p)
+
+def expire_chunked_uploads(max_age_hours):
+    """
+    一定時間更新のないアップロードを削除する。
+    確定済みでも、変換ジョブ (pending / running) が残っていなければ取り残されたものとして消す。
+    """
+    limit = time.time() - max_age_hours * 3600
+    removed = 0
+    active = None
+    with os.scandir(app.config['UPLOAD_TEMP']) as it:
+        for entry in it:
+            if not entry.name.endswith('.part') or entry.stat().st_mtime >= limit: continue
+            upload_id = entry.name[:-len('.part')]
+            with entity_lock('upload', upload_id):
+                info = load_chunked_upload(upload_id)
+                if info and info.get('finalized'):
+                    if active is None: active = active_upload_jobs()
+                    if upload_id in active: continue
+                delete_chunked_upload(upload_id)
+                removed += 1
+    return removed
+
+# --- HLS パッケージング (任意) ---
+
+def hls_dir(filename):
+    return storage_path(app.config['HLS_FOLDER'], filename.rsplit('.', 1)[0], create=True)
+
+def package_hls(filename):
+    """
+    変換済み MP3 を HLS (MPEG-TS セグメント + m3u8) に分割する。再エンコードはしない。
+    成功したら HLS_FOLDER からの相対パス (<base_id>/index.m3u8) を返す。無効時/失敗時は None。
+    """
+    if not app.config['HLS_ENABLED'] or not filename: return None
+    out_dir = hls_dir(filename)
+    tmp_dir = f"{out_dir}.{uuid.uuid4().hex}.tmp"
+    os.makedirs(tmp_dir)
+    try:
+        subprocess.run(['ffmpeg', '-y', '-i', resolve_storage_path(app.config['MUSIC_FOLDER'], filename),
+                        '-map', 'a', '-c:a', 'copy', '-f', 'hls',
+                        '-hls_time', str(app.config['HLS_SEGMENT_SECONDS']), '-hls_playlist_type', 'vod',
+                        '-hls_segment_filename', os.path.join(tmp_dir, 'seg%05d.ts'),
+                        os.path.join(tmp_dir, 'index.m3u8')],
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        # プレイリストが書きかけの状態で見えないよう、完成してからディレクトリごと公開する
+        if os.path.exists(out_dir): shutil.rmtree(out_dir)
+        os.rename(tmp_dir, out_dir)
+    except Exception as e:
+        logging.error(f"HLS packaging error ({filename}): {e}")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return None
+    return f"{os.path.basename(out_dir)}/index.m3u8"
+
+def set_track_audio(target, filename, hls):
+    target['filename'] = filename
+    if hls: target['hls'] = hls
+    elif 'hls' in target: del target['hls']
+
+def remove_track_audio(target):
+    """トラックの MP3 と HLS セグメントを削除する"""
+    if target.get('filename'):
+        p = resolve_storage_path(app.config['MUSIC_FOLDER'], target['filename'])
+        if os.path.exists(p):
+            os.remove(p)
+            logging.info(f"Deleted old file: {p}")
+    if target.get('hls'):
+        shutil.rmtree(resolve_storage_path(app.config['HLS_FOLDER'], os.path.dirname(target['hls'])), ignore_errors=True)
+
 # --- 共通：Spotify/YouTube DL ロジック ---
 
-def process_album_download_logic(album_id, url, temp_track_id, start_track_num, loop):
-    """アルバム一括ダウンロード用"""
+def track_title_key(title):
+    """曲名の比較用キー (状態表示の【...】・拡張子・大文字小文字を無視する)"""
+    title = (title or '').strip()
+    while title.startswith('【') and '】' in title: title = title.split('】', 1)[1].strip()
+    if allowed_audio(title): title = title.rsplit('.', 1)[0]
+    return title.casefold()
+
+def replace_stale_placeholders(album, download_queue, placeholder_of=lambda item: item):
+    """
+    再実行 (ワーカー停止後の再キュー・再試行) でも曲が重複しないようにする。
+    同じ URL の未完了トラック (前回の実行が残した【DL中...】等) を取り除き、完了済みの URL はキューから外す。
+    """
+    urls = {placeholder_of(item)['original_url'] for item in download_queue}
+    album['tracks'] = [t for t in album['tracks'] if t.get('status') == 'completed' or t.get('original_url') not in urls]
+    completed = {t.get('original_url') for t in album['tracks']}
+    download_queue[:] = [item for item in download_queue if placeholder_of(item)['original_url'] not in completed]
+
+def process_album_download_logic(album_id, url, temp_track_id, start_track_num, loop, skip_existing=False):
+    """
+    アルバム一括ダウンロード用 (skip_existing: 既に登録済みの曲は追加しない = 差分同期)。
+    登録済みの判定は URL / spotify_id に加え、曲名・手動登録の曲の曲番号でも行う (アップロード済みの曲を重複させない)。
+    検索に失敗したら例外、それ以外はダウンロードに失敗した曲数を返す。
+    """
     logging.info(f"Start Processing Album Download: {album_id} - {url}")
+    from spotdl.download.downloader import Downloader
     try:
-        songs = spotify_search_client.search([url])
+        spotdl = get_spotdl_instance()
+        if not spotdl: raise Exception("SpotDL not initialized")
+        songs = spotdl.search([url])
         songs.sort(key=lambda s: (s.disc_number or 0, s.track_number or 0))
     except Exception as e:
         logging.error(f"Search failed for {url}: {e}")
-        return
-
-    album = load_album(album_id)
-    if not album: return
-
-    if temp_track_id:
-        album['tracks'] = [t for t in album['tracks'] if t['id'] != temp_track_id]
+        raise Exception(f"Search failed: {e}")
 
     download_queue = []
     current_num = start_track_num
@@ -256,25 +584,37 @@ def process_album_download_logic(album_id, url, temp_track_id, start_track_num,
         placeholder = {
             "id": track_id, "title": f"【待機中】 {song_title}", "track_number": int(current_num),
             "filename": None, "processing": True, "status": "pending",
-            "source_type": "spotify", "original_url": song.url
+            "source_type": "spotify", "original_url": song.url, "spotify_id": getattr(song, 'song_id', None)
         }
-        album['tracks'].append(placeholder)
         download_queue.append((placeholder, song))
         current_num += 1
-    
-    save_album(album)
+
+    def add_placeholders(album):
+        if temp_track_id:
+            album['tracks'] = [t for t in album['tracks'] if t['id'] != temp_track_id]
+        replace_stale_placeholders(album, download_queue, lambda item: item[0])
+        if skip_existing:
+            known = {t.get('original_url') for t in album['tracks']} | {t.get('spotify_id') for t in album['tracks']}
+            known_titles = {track_title_key(t.get('title')) for t in album['tracks']}
+            manual_numbers = {t.get('track_number') for t in album['tracks'] if t.get('source_type') != 'spotify'}
+            download_queue[:] = [(p, song) for p, song in download_queue
+                                 if p['original_url'] not in known and (not p['spotify_id'] or p['spotify_id'] not in known)
+                                 and track_title_key(song.name) not in known_titles
+                                 and p['track_number'] not in manual_numbers]
+        album['tracks'].extend(dict(p) for p, _ in download_queue)
+        if skip_existing and not download_queue and not temp_track_id: return False
+
+    if not update_album(album_id, add_placeholders): return 0
+    if skip_existing: logging.info(f"Album sync: {len(download_queue)} new tracks for {album_id}")
+    failed = 0
 
     dl_settings = { "headless": True, "simple_tui": True, "audio_providers": ["youtube-music", "youtube"] }
 
     for item_dict, song_obj in download_queue:
-        album = load_album(album_id)
-        if not album: break
-        target = next((t for t in album['tracks'] if t['id'] == item_dict['id']), None)
-        if not target: continue
-
-        target['title'] = f"【DL中...】 {song_obj.name}"
-        target['status'] = "downloading"
-        save_album(album)
+        def mark_downloading(target):
+            target['title'] = f"【DL中...】 {song_obj.name}"
+            target['status'] = "downloading"
+        if not update_track(album_id, item_dict['id'], mark_downloading): continue
 
         try:
             base_id = uuid.uuid4().hex
@@ -293,26 +633,32 @@ def process_album_download_logic(album_id, url, temp_track_id, start_track_num,
                 if not dl_file or dl_file == 'None' or not os.path.exists(dl_file):
                     raise Exception("Download failed (File not found)")
 
-                final_path = os.path.join(app.config['MUSIC_FOLDER'], f"{base_id}.mp3")
+                final_path = storage_path(app.config['MUSIC_FOLDER'], f"{base_id}.mp3", create=True)
                 subprocess.run(['ffmpeg', '-y', '-i', dl_file, '-b:a', '320k', '-map', 'a', final_path],
                                check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
                 if os.path.exists(temp_dl_dir): shutil.rmtree(temp_dl_dir)
-
-                target['title'] = song_obj.name
-                target['filename'] = f"{base_id}.mp3"
-                target['status'] = "completed"
-                if 'processing' in target: del target['processing']
-                save_album(album)
+                hls = package_hls(f"{base_id}.mp3")
+
+                def mark_completed(target):
+                    target['title'] = song_obj.name
+                    set_track_audio(target, f"{base_id}.mp3", hls)
+                    target['status'] = "completed"
+                    if 'processing' in target: del target['processing']
+                if not update_track(album_id, item_dict['id'], mark_completed):
+                    remove_track_audio({"filename": f"{base_id}.mp3", "hls": hls})  # 途中で削除/置き換えられた
             else:
                 raise Exception("No file returned")
         except Exception as e:
             logging.error(f"DL Error: {e}")
-            target['title'] = f"【エラー】 {song_obj.name}"
-            target['status'] = "error"
-            target['error_msg'] = str(e)
-            if 'processing' in target: del target['processing']
-            save_album(album)
+            def mark_error(target):
+                target['title'] = f"【エラー】 {song_obj.name}"
+                target['status'] = "error"
+                target['error_msg'] = str(e)
+                if 'processing' in target: del target['processing']
+            update_track(album_id, item_dict['id'], mark_error)
+            failed += 1
             if os.path.exists(os.path.join(app.config['SPOTDL_TEMP'], base_id)): shutil.rmtree(os.path.join(app.config['SPOTDL_TEMP'], base_id))
+    return failed
 
 # --- 音声差し替え用バックグラウンド処理 ---
 
@@ -328,27 +674,23 @@ def background_replace_process(album_id, track_id, url, source_type):
     
     try:
         album = load_album(album_id)
-        if not album: return
-        target = next((t for t in album['tracks'] if t['id'] == track_id), None)
-        if not target: return
+        target = find_track(album, track_id) if album else None
+        if not target: raise Exception("Track not found")
 
         # 古いファイルを削除
-        if target.get('filename'):
-            old_path = os.path.join(app.config['MUSIC_FOLDER'], target['filename'])
-            if os.path.exists(old_path):
-                os.remove(old_path)
-                logging.info(f"Deleted old file: {old_path}")
+        remove_track_audio(target)
 
         # 新しいファイル名 (キャッシュ対策で新しいUUIDにする)
         base_id = uuid.uuid4().hex
         new_filename = f"{base_id}.mp3"
-        final_path = os.path.join(app.config['MUSIC_FOLDER'], new_filename)
+        final_path = storage_path(app.config['MUSIC_FOLDER'], new_filename, create=True)
 
         # --- YouTube Download ---
         if source_type == 'youtube':
+            import yt_dlp
             ydl_opts = {
                 'format': 'bestaudio/best',
-                'outtmpl': os.path.join(app.config['MUSIC_FOLDER'], base_id), # 拡張子なしで指定
+                'outtmpl': os.path.splitext(final_path)[0], # 拡張子なしで指定
                 'postprocessors': [{'key': 'FFmpegExtractAudio','preferredcodec': 'mp3','preferredquality': '320'}],
                 'quiet': True, 'ignoreerrors': True
             }
@@ -363,6 +705,7 @@ def background_replace_process(album_id, track_id, url, source_type):
 
         # --- Spotify Download ---
         elif source_type == 'spotify':
+            from spotdl.download.downloader import Downloader
             spotdl = get_spotdl_instance() # 検索用
             try:
                 songs = spotdl.search([url])
@@ -392,42 +735,53 @@ def background_replace_process(album_id, track_id, url, source_type):
             else:
                 raise Exception("No file returned from SpotDL")
 
-        # 完了処理
-        album = load_album(album_id) # 最新をリロード
-        target = next((t for t in album['tracks'] if t['id'] == track_id), None)
-        if target:
-            target['filename'] = new_filename
+        # 完了処理 (ロック下で最新をリロードして更新)
+        hls = package_hls(new_filename)
+        def mark_completed(target):
+            set_track_audio(target, new_filename, hls)
             target['status'] = 'completed'
             target['original_url'] = url
             target['source_type'] = source_type
             if 'processing' in target: del target['processing']
             if 'error_msg' in target: del target['error_msg']
-            save_album(album)
-            logging.info(f"Replace Success: {target['title']}")
+        target = update_track(album_id, track_id, mark_completed)
+        if target: logging.info(f"Replace Success: {target['title']}")
 
     except Exception as e:
         logging.error(f"Replace Error: {e}")
-        album = load_album(album_id)
-        target = next((t for t in album['tracks'] if t['id'] == track_id), None)
-        if target:
+        def mark_error(target):
             target['status'] = 'error'
             target['error_msg'] = str(e)
             target['title'] = f"【エラー】 {target['title'].replace('【処理中】 ', '').replace('【エラー】 ', '')}"
             if 'processing' in target: del target['processing']
-            save_album(album)
+        update_track(album_id, track_id, mark_error)
+        raise
     finally:
         try: loop.close()
         except: pass
 
 # --- バックグラウンド処理 (単体アルバム/プレイリスト) ---
 
+def mark_temp_track_error(album_id, temp_track_id, error):
+    """プレースホルダ追加前に失敗した場合、仮トラック (初期化中.../再試行中) をエラーにして再試行できるようにする"""
+    if not temp_track_id: return
+    def mark_error(target):
+        target['status'] = 'error'
+        target['error_msg'] = str(error)
+        target['title'] = f"【エラー】 {target['title'].split('】 ', 1)[-1]}"
+        if 'processing' in target: del target['processing']
+    update_track(album_id, temp_track_id, mark_error)
+
 def background_spotify_process(album_id, url, temp_track_id, start_track_num):
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     try:
-        process_album_download_logic(album_id, url, temp_track_id, start_track_num, loop)
+        failed = process_album_download_logic(album_id, url, temp_track_id, start_track_num, loop)
+        if failed: raise Exception(f"{failed} tracks failed")
     except Exception as e:
         logging.error(f"Background Process Error: {e}")
+        mark_temp_track_error(album_id, temp_track_id, e)
+        raise
     finally:
         try: loop.close()
         except: pass
@@ -437,6 +791,7 @@ def background_spotify_process(album_id, url, temp_track_id, start_track_num):
 def background_youtube_process(album_id, url, temp_track_id, start_track_num):
     logging.info(f"Start YouTube DL: {url}")
     try:
+        import yt_dlp
         ydl_opts_info = {'quiet': True, 'extract_flat': 'in_playlist', 'ignoreerrors': True}
         with yt_dlp.YoutubeDL(ydl_opts_info) as ydl:
             info = ydl.extract_info(url, download=False)
@@ -445,10 +800,6 @@ def background_youtube_process(album_id, url, temp_track_id, start_track_num):
         if 'entries' in info: entries = list(info['entries'])
         else: entries = [info]
 
-        album = load_album(album_id)
-        if not album: return
-        if temp_track_id: album['tracks'] = [t for t in album['tracks'] if t['id'] != temp_track_id]
-
         download_queue = []
         current_num = start_track_num
 
@@ -463,10 +814,16 @@ def background_youtube_process(album_id, url, temp_track_id, start_track_num):
                 "filename": None, "processing": True, "status": "pending",
                 "source_type": "youtube", "original_url": video_url
             }
-            album['tracks'].append(placeholder)
             download_queue.append(placeholder)
             current_num += 1
-        save_album(album)
+
+        def add_placeholders(album):
+            if temp_track_id: album['tracks'] = [t for t in album['tracks'] if t['id'] != temp_track_id]
+            replace_stale_placeholders(album, download_queue)
+            album['tracks'].extend(dict(p) for p in download_queue)
+
+        if not update_album(album_id, add_placeholders): return
+        failed = 0
 
         ydl_opts_dl = {
             'format': 'bestaudio/best',
@@ -475,18 +832,14 @@ def background_youtube_process(album_id, url, temp_track_id, start_track_num):
         }
 
         for item in download_queue:
-            album = load_album(album_id)
-            if not album: break
-            target = next((t for t in album['tracks'] if t['id'] == item['id']), None)
-            if not target: continue
-
-            target['title'] = f"【DL中...】 {item['title'].replace('【待機中】 ', '')}"
-            target['status'] = "downloading"
-            save_album(album)
+            def mark_downloading(target):
+                target['title'] = f"【DL中...】 {item['title'].replace('【待機中】 ', '')}"
+                target['status'] = "downloading"
+            if not update_track(album_id, item['id'], mark_downloading): continue
 
             try:
                 base_id = uuid.uuid4().hex
-                save_path_base = os.path.join(app.config['MUSIC_FOLDER'], base_id)
+                save_path_base = os.path.splitext(storage_path(app.config['MUSIC_FOLDER'], f"{base_id}.mp3", create=True))[0]
                 current_opts = ydl_opts_dl.copy()
                 current_opts['outtmpl'] = save_path_base
 
@@ -494,22 +847,97 @@ def background_youtube_process(album_id, url, temp_track_id, start_track_num):
                     dl_info = ydl.extract_info(item['original_url'], download=True)
                     if not dl_info: raise Exception("Download failed")
                     real_title = dl_info.get('track') or dl_info.get('title', 'Unknown Title')
-
-                target['title'] = real_title
-                target['filename'] = f"{base_id}.mp3"
-                target['status'] = "completed"
-                if 'processing' in target: del target['processing']
-                save_album(album)
+                hls = package_hls(f"{base_id}.mp3")
+
+                def mark_completed(target):
+                    target['title'] = real_title
+                    set_track_audio(target, f"{base_id}.mp3", hls)
+                    target['status'] = "completed"
+                    if 'processing' in target: del target['processing']
+                if not update_track(album_id, item['id'], mark_completed):
+                    remove_track_audio({"filename": f"{base_id}.mp3", "hls": hls})
             except Exception as e:
-                target['title'] = f"【エラー】 {item['title'].replace('【待機中】 ', '')}"
-                target['status'] = "error"
-                target['error_msg'] = str(e)
-                if 'processing' in target: del target['processing']
-                save_album(album)
+                def mark_error(target):
+                    target['title'] = f"【エラー】 {item['title'].replace('【待機中】 ', '')}"
+                    target['status'] = "error"
+                    target['error_msg'] = str(e)
+                    if 'processing' in target: del target['processing']
+                update_track(album_id, item['id'], mark_error)
+                failed += 1
+        if failed: raise Exception(f"{failed} tracks failed")
     except Exception as e:
         logging.error(f"YouTube Error: {e}")
+        mark_temp_track_error(album_id, temp_track_id, e)
+        raise
+
+# --- バックグラウンド処理 (アーティスト一括インポート / 差分同期) ---
+
+def fetch_artist_releases(sp_client, artist_ref):
+    """アーティストのアルバム/シングルを全ページ取得する (同名は最初の 1 件のみ)"""
+    results = sp_client.artist_albums(artist_ref, album_type='album,single', limit=50)
+    items = list(results['items'])
+    while results.get('next'):
+        results = sp_client.next(results)
+        if not results: break
+        items.extend(results['items'])
+
+    releases, processed_albums = [], []
+    for item in items:
+        if item['name'] in processed_albums: continue
+        processed_albums.append(item['name'])
+        releases.append(item)
+    return releases
+
+def import_spotify_release(artist_id, artist_name, item, loop):
+    """Spotify のアルバム 1 件を登録して曲をダウンロードする"""
+    album_name = item['name']
+    release_date = item['release_date']
+    year = release_date.split('-')[0] if release_date else ""
+    
+    raw_type = item['album_type']
+    total_tracks = item['total_tracks']
+    
+    atype = 'Album'
+    if raw_type == 'single':
+        if total_tracks > 1: atype = 'EP'
+        else: atype = 'Single'
+    elif raw_type == 'album':
+        atype = 'Album'
 
-# --- バックグラウンド処理 (アーティスト一括インポート) ---
+    alb_img_url = item['images'][0]['url'] if item['images'] else None
+    alb_img_filename = download_image_from_url(alb_img_url) if alb_img_url else None
+
+    album_uuid = str(uuid.uuid4())
+    
+    update_artist(artist_id, lambda a: a['albums'].append({
+        "id": album_uuid, "title": album_name, "year": year, 
+        "type": atype, "cover_image": alb_img_filename, "spotify_id": item.get('id')
+    }))
+
+    new_album_detail = {
+        "id": album_uuid, "artist_id": artist_id, "artist_name": artist_name,
+        "title": album_name, "year": year, "type": atype,
+        "cover_image": alb_img_filename, "spotify_id": item.get('id'), "tracks": []
+    }
+    save_album(new_album_detail)
+    
+    logging.info(f"Album Created: {album_name}")
+
+    alb_url = item['external_urls']['spotify']
+    return process_album_download_logic(album_uuid, alb_url, None, 1, loop)
+
+def run_release(failures, item, fn, *args):
+    """リリース 1 件分の処理。失敗しても残りのリリースは続け、内容を failures に記録する"""
+    try:
+        failed = fn(*args)
+        if failed: failures.append(f"{item['name']}: {failed} tracks failed")
+    except Exception as e:
+        logging.error(f"Release failed ({item['name']}): {e}")
+        failures.append(f"{item['name']}: {e}")
+
+def find_artist_by_spotify_id(spotify_id):
+    summary = next((a for a in load_index() if a.get('spotify_id') == spotify_id), None)
+    return load_artist(summary['id']) if summary else None
 
 def background_artist_import_process(artist_url):
     loop = asyncio.new_event_loop()
@@ -517,9 +945,18 @@ def background_artist_import_process(artist_url):
     
     logging.info(f"Start Artist Import: {artist_url}")
     try:
+        sp_client = get_spotipy_client()
         if not sp_client: raise Exception("Spotipy not initialized")
 
         results = sp_client.artist(artist_url)
+
+        # 既にインポート済みのアーティストなら新規作成せず差分同期する
+        existing = find_artist_by_spotify_id(results['id']) if results.get('id') else None
+        if existing:
+            logging.info(f"Artist already imported, syncing instead: {existing['name']}")
+            sync_artist_releases(existing['id'], loop)
+            return
+
         artist_name = results['name']
         artist_genres = ", ".join(results['genres'])
         artist_img_url = results['images'][0]['url'] if results['images'] else None
@@ -532,107 +969,442 @@ def background_artist_import_process(artist_url):
         new_artist = {
             "id": artist_id, "name": artist_name, "genre": artist_genres,
             "description": "Imported from Spotify", "image": artist_img_filename,
-            "albums": []
+            "spotify_id": results.get('id'), "albums": []
         }
         save_artist(new_artist)
         logging.info(f"Artist Created: {artist_name}")
 
-        albums_results = sp_client.artist_albums(artist_url, album_type='album,single', limit=50)
-        processed_albums = []
+        failures = []
+        for item in fetch_artist_releases(sp_client, artist_url):
+            run_release(failures, item, import_spotify_release, artist_id, artist_name, item, loop)
+            time.sleep(1)
+        if failures: raise Exception("; ".join(failures))
 
-        for item in albums_results['items']:
-            album_name = item['name']
-            if album_name in processed_albums: continue
-            processed_albums.append(album_name)
+    except Exception as e:
+        logging.error(f"Artist Import Error: {e}")
+        raise
+    finally:
+        try: loop.close()
+        except: pass
 
-            release_date = item['release_date']
-            year = release_date.split('-')[0] if release_date else ""
-            
-            raw_type = item['album_type']
-            total_tracks = item['total_tracks']
-            
-            atype = 'Album'
-            if raw_type == 'single':
-                if total_tracks > 1: atype = 'EP'
-                else: atype = 'Single'
-            elif raw_type == 'album':
-                atype = 'Album'
+def sync_artist_releases(artist_id, loop, artist_url=None):
+    """
+    Spotify 上のディスコグラフィと比較して、未登録のアルバムを作成し、
+    登録済みアルバムで曲数が足りないものは不足分の曲だけダウンロードする。
+    artist_url を渡すと spotify_id を持たない (手動作成/旧データの) アーティストを紐付ける。
+    """
+    with entity_lock('sync', artist_id):
+        sp_client = get_spotipy_client()
+        if not sp_client: raise Exception("Spotipy not initialized")
 
-            alb_img_url = item['images'][0]['url'] if item['images'] else None
-            alb_img_filename = download_image_from_url(alb_img_url) if alb_img_url else None
+        artist = load_artist(artist_id)
+        if not artist: raise Exception(f"Artist not found: {artist_id}")
+        if artist_url:
+            spotify_id = sp_client.artist(artist_url)['id']
+            def link(a): a['spotify_id'] = spotify_id
+            artist = update_artist(artist_id, link)
+        if not artist.get('spotify_id'): raise Exception(f"Artist has no Spotify ID: {artist['name']}")
+
+        logging.info(f"Start Artist Sync: {artist['name']}")
+        by_spotify_id = {a['spotify_id']: a for a in artist['albums'] if a.get('spotify_id')}
+        by_title = {a['title']: a for a in artist['albums'] if not a.get('spotify_id')}
+        created = 0
+        failures = []
+
+        for item in fetch_artist_releases(sp_client, artist['spotify_id']):
+            known = by_spotify_id.get(item.get('id')) or by_title.get(item['name'])
+            if not known:
+                run_release(failures, item, import_spotify_release, artist_id, artist['name'], item, loop)
+                created += 1
+                time.sleep(1)
+                continue
+
+            album = load_album(known['id'])
+            if not album: continue
+            if not known.get('spotify_id'):
+                # 旧データ: タイトルで一致したアルバムに spotify_id を記録しておく
+                def link_summary(a):
+                    for r in a['albums']:
+                        if r['id'] == known['id']: r['spotify_id'] = item.get('id')
+                update_artist(artist_id, link_summary)
+                album = update_album(known['id'], lambda alb: alb.update(spotify_id=item.get('id'))) or album
+
+            # アップロード等で手動登録した曲も数える (足りない分だけを曲名・曲番号で照合して追加する)。
+            # 停止したワーカーが残した未完了の曲は数えず、やり直させる
+            done = [t for t in album['tracks'] if t.get('status') == 'completed' or t.get('source_type') != 'spotify']
+            if len(done) >= item['total_tracks']: continue
+            # 番号は通常インポートと同じ (アルバム内の曲順) になるよう 1 から振る
+            run_release(failures, item, process_album_download_logic,
+                        known['id'], item['external_urls']['spotify'], None, 1, loop, True)
+
+        update_artist(artist_id, lambda a: a.update(last_synced=time.strftime('%Y-%m-%d %H:%M:%S')))
+        logging.info(f"Artist Sync done: {artist['name']} ({created} new releases)")
+        if failures: raise Exception("; ".join(failures))
+
+def background_artist_sync_process(artist_id, artist_url=None):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        sync_artist_releases(artist_id, loop, artist_url)
+    except Exception as e:
+        logging.error(f"Artist Sync Error: {e}")
+        raise
+    finally:
+        try: loop.close()
+        except: pass
 
-            album_uuid = str(uuid.uuid4())
-            
-            artist_data = load_artist(artist_id)
-            artist_data['albums'].append({
-                "id": album_uuid, "title": album_name, "year": year, 
-                "type": atype, "cover_image": alb_img_filename
-            })
-            save_artist(artist_data)
+# --- バックグラウンド処理 (アップロードの変換) ---
 
-            new_album_detail = {
-                "id": album_uuid, "artist_id": artist_id, "artist_name": artist_name,
-                "title": album_name, "year": year, "type": atype,
-                "cover_image": alb_img_filename, "tracks": []
-            }
-            save_album(new_album_detail)
-            
-            logging.info(f"Album Created: {album_name}")
+def background_upload_process(album_id, track_id, upload_id):
+    """確定済みのアップロード (分割アップロード / フォームで受け取ったファイル) を MP3 に変換してトラックに設定する"""
+    part_path, _ = chunked_upload_paths(upload_id)
+    info = load_chunked_upload(upload_id)
+    logging.info(f"Start Upload Convert: {upload_id} ({info['filename'] if info else 'missing'})")
+    try:
+        if not info: raise Exception("Upload not found")
+        new_filename = transcode_to_mp3(part_path)
+        if not new_filename: raise Exception("Convert Error")
+        hls = package_hls(new_filename)
+
+        def mark_completed(target):
+            remove_track_audio(target)
+            set_track_audio(target, new_filename, hls)
+            target['status'] = 'completed'
+            target['source_type'] = 'upload'
+            target['title'] = target['title'].replace('【変換中】 ', '')
+            if 'processing' in target: del target['processing']
+            if 'error_msg' in target: del target['error_msg']
+        if update_track(album_id, track_id, mark_completed):
+            logging.info(f"Upload Convert Success: {upload_id}")
+        else:
+            remove_track_audio({"filename": new_filename, "hls": hls})
+    except Exception as e:
+        logging.error(f"Upload Convert Error: {e}")
+        def mark_error(target):
+            target['status'] = 'error'
+            target['error_msg'] = str(e)
+            target['title'] = f"【エラー】 {target['title'].replace('【変換中】 ', '')}"
+            if 'processing' in target: del target['processing']
+        update_track(album_id, track_id, mark_error)
+        raise
+    finally:
+        delete_chunked_upload(upload_id)
+
+# --- ジョブキュー (バックグラウンド処理の起動) ---
+# JOB_MODE = 'thread' : Web プロセス内のスレッドで実行 (python app.py の開発用)
+# JOB_MODE = 'queue'  : data/jobs.sqlite3 に積むだけ。worker.py が別プロセスで実行する
+# ハンドラは失敗時 (一部の曲の失敗を含む) にトラックをエラーにした上で例外を送出する -> jobs.status = 'error'
+
+JOB_HANDLERS = {
+    'artist_import': background_artist_import_process,
+    'artist_sync': background_artist_sync_process,
+    'spotify': background_spotify_process,
+    'youtube': background_youtube_process,
+    'replace': background_replace_process,
+    'upload': background_upload_process,
+}
+
+def job_db():
+    conn = sqlite3.connect(app.config['JOB_DB'], timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, args TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending', worker TEXT, error TEXT,
+        created_at REAL, started_at REAL, finished_at REAL)""")
+    conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+    return conn
+
+def start_job(kind, *args):
+    if kind not in JOB_HANDLERS: raise ValueError(f"Unknown job: {kind}")
+    if app.config['JOB_MODE'] == 'queue':
+        conn = job_db()
+        try:
+            conn.execute("INSERT INTO jobs (kind, args, created_at) VALUES (?, ?, ?)",
+                         (kind, json.dumps(args, ensure_ascii=False), time.time()))
+        finally:
+            conn.close()
+        logging.info(f"Job queued: {kind} {args}")
+    else:
+        threading.Thread(target=run_job_in_thread, args=(kind, args)).start()
 
-            alb_url = item['external_urls']['spotify']
-            process_album_download_logic(album_uuid, alb_url, None, 1, loop)
-            
-            import time
-            time.sleep(1)
+def run_job_in_thread(kind, args):
+    # 失敗はハンドラ側でログ済み (キューの場合は worker.py が jobs.error に記録する)
+    try: JOB_HANDLERS[kind](*args)
+    except Exception: pass
 
-    except Exception as e:
-        logging.error(f"Artist Import Error: {e}")
+def claim_job(conn, worker_name):
+    """pending のジョブを 1 件 running にして返す (無ければ None)"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT * FROM jobs WHERE status = 'pending' ORDER BY id LIMIT 1").fetchone()
+        if row:
+            conn.execute("UPDATE jobs SET status = 'running', worker = ?, started_at = ? WHERE id = ?",
+                         (worker_name, time.time(), row['id']))
+        conn.execute("COMMIT")
+        return row
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+def finish_job(conn, job_id, error=None):
+    conn.execute("UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                 ('error' if error else 'done', error, time.time(), job_id))
+
+def active_upload_jobs():
+    """pending / running の変換ジョブが参照している upload_id の集合"""
+    conn = job_db()
+    try:
+        rows = conn.execute("SELECT args FROM jobs WHERE kind = 'upload' AND status IN ('pending', 'running')").fetchall()
     finally:
-        try: loop.close()
-        except: pass
+        conn.close()
+    return {json.loads(row['args'])[2] for row in rows}
+
+def run_job(row):
+    JOB_HANDLERS[row['kind']](*json.loads(row['args']))
 
 # --- API / Routes ---
 
+def json_response(data, status=200):
+    return Response(dumps_json(data), status=status, mimetype='application/json')
+
+def external_url_builder(endpoint, key):
+    """
+    url_for(endpoint, key=値, _external=True) と同じ URL を返す関数を作る。
+    一覧で件数分 url_for を呼ぶと重いので、プレフィックスは 1 回だけ組み立てる。
+    """
+    prefix = url_for(endpoint, **{key: '-'}, _external=True, _scheme='https')[:-1]
+    return lambda value: prefix + quote(str(value), safe='/')
+
+@app.after_request
+def compress_api_response(resp):
+    """/api/* の JSON を Accept-Encoding に応じて brotli / gzip 圧縮する"""
+    if not request.path.startswith('/api/') or resp.mimetype != 'application/json': return resp
+    resp.vary.add('Accept-Encoding')
+    if resp.direct_passthrough or 'Content-Encoding' in resp.headers or not 200 <= resp.status_code < 300:
+        return resp
+    data = resp.get_data()
+    if len(data) < app.config['API_COMPRESS_MIN_SIZE']: return resp
+    accept = request.accept_encodings
+    if brotli and accept['br']:
+        resp.set_data(brotli.compress(data, quality=5)); resp.headers['Content-Encoding'] = 'br'
+    elif accept['gzip']:
+        resp.set_data(gzip.compress(data, compresslevel=5)); resp.headers['Content-Encoding'] = 'gzip'
+    return resp
+
+@app.errorhandler(ConflictError)
+def handle_conflict(e):
+    logging.warning(f"Write conflict: {e}")
+    return "他の処理と同時に更新されました。再読み込みしてやり直してください。", 409
+
 @app.route('/stream/<path:filename>')
 def stream_music(filename):
-    return send_from_directory(app.config['MUSIC_FOLDER'], filename)
+    return send_stored_file(app.config['MUSIC_FOLDER'], filename)
+
+@app.route('/hls/<path:filename>')
+def serve_hls(filename):
+    mimetype = 'application/vnd.apple.mpegurl' if filename.endswith('.m3u8') else 'video/mp2t'
+    return send_stored_file(app.config['HLS_FOLDER'], filename, mimetype=mimetype)
 
 @app.route('/image/<path:filename>')
 def serve_image(filename):
-    return send_from_directory(app.config['IMAGES_FOLDER'], filename)
+    return send_stored_file(app.config['IMAGES_FOLDER'], filename)
 
 @app.route('/api/artists')
 def api_get_artists():
     data = load_index()
+    image_url = external_url_builder('serve_image', 'filename')
+    api_url = external_url_builder('api_get_artist_detail', 'artist_id')
     for artist in data:
         if artist.get('image'):
-            artist['image_url'] = url_for('serve_image', filename=artist['image'], _external=True, _scheme='https')
-        artist['api_url'] = url_for('api_get_artist_detail', artist_id=artist['id'], _external=True, _scheme='https')
-    return jsonify(data)
+            artist['image_url'] = image_url(artist['image'])
+        artist['api_url'] = api_url(artist['id'])
+    return json_response(data)
 
 @app.route('/api/artist/<artist_id>')
 def api_get_artist_detail(artist_id):
     artist = load_artist(artist_id)
-    if not artist: return jsonify({"error": "Artist not found"}), 404
+    if not artist: return json_response({"error": "Artist not found"}, 404)
+    image_url = external_url_builder('serve_image', 'filename')
+    api_url = external_url_builder('api_get_album_detail', 'album_id')
     if artist.get('image'):
-        artist['image_url'] = url_for('serve_image', filename=artist['image'], _external=True, _scheme='https')
+        artist['image_url'] = image_url(artist['image'])
     for album in artist['albums']:
         if album.get('cover_image'):
-            album['cover_url'] = url_for('serve_image', filename=album['cover_image'], _external=True, _scheme='https')
-        album['api_url'] = url_for('api_get_album_detail', album_id=album['id'], _external=True, _scheme='https')
-    return jsonify(artist)
+            album['cover_url'] = image_url(album['cover_image'])
+        album['api_url'] = api_url(album['id'])
+    artist['zip_url'] = url_for('api_download_artist_zip', artist_id=artist_id, _external=True, _scheme='https')
+    return json_response(artist)
 
 @app.route('/api/album/<album_id>')
 def api_get_album_detail(album_id):
     album = load_album(album_id)
-    if not album: return jsonify({"error": "Album not found"}), 404
+    if not album: return json_response({"error": "Album not found"}, 404)
     if album.get('cover_image'):
         album['cover_url'] = url_for('serve_image', filename=album['cover_image'], _external=True, _scheme='https')
+    stream_url = external_url_builder('stream_music', 'filename')
+    hls_url = external_url_builder('serve_hls', 'filename')
     for track in album['tracks']:
         if track.get('status') == 'completed' and track.get('filename'):
-            track['stream_url'] = url_for('stream_music', filename=track['filename'], _external=True, _scheme='https')
+            track['stream_url'] = stream_url(track['filename'])
+            if track.get('hls'):
+                track['hls_url'] = hls_url(track['hls'])
         track['cover_url'] = album.get('cover_url')
-    return jsonify(album)
+    album['zip_url'] = url_for('api_download_album_zip', album_id=album_id, _external=True, _scheme='https')
+    return json_response(album)
+
+# --- ZIP エクスポート (オフライン用・一括ダウンロード) ---
+# 一時ファイルを作らず、組み立てながらそのままレスポンスに流す。MP3 は無圧縮 (STORED) で格納する。
+# zipfile は seek できない出力先だと CRC・サイズを後置 (データディスクリプタ) にするが、
+# STORED のエントリでそれを受け付けないストリーミング展開 (Android の ZipInputStream 等) があるため、
+# CRC を先に計算してローカルヘッダに実際の値を書く。
+
+ZIP64_LIMIT = 0xFFFFFFFF
+
+@lru_cache(maxsize=4096)
+def _file_crc32(path, size, mtime_ns):
+    crc = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(1024 * 1024)
+            if not chunk: break
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+def file_crc32(path):
+    """ファイルの CRC32 (パス・サイズ・更新時刻でキャッシュする。music/ のファイルは書き換えられない)"""
+    st = os.stat(path)
+    return _file_crc32(path, st.st_size, st.st_mtime_ns)
+
+class ZipStream:
+    """STORED 専用のストリーミング ZIP。各メソッドはレスポンスに流すバイト列を返す (add_file はチャンクを yield)"""
+    def __init__(self):
+        self.offset = 0
+        self.entries = []
+
+    def _local_header(self, arcname, crc, size, mtime):
+        name = arcname.encode('utf-8')
+        t = time.localtime(mtime)
+        dos_date = max(t.tm_year - 1980, 0) << 9 | t.tm_mon << 5 | t.tm_mday
+        dos_time = t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2
+        zip64 = size >= ZIP64_LIMIT
+        extra = struct.pack('<HHQQ', 1, 16, size, size) if zip64 else b''
+        self.entries.append((name, crc, size, self.offset, dos_time, dos_date))
+        header = struct.pack('<IHHHHHIIIHH', 0x04034b50, 45 if zip64 else 20, 0x800, 0, dos_time, dos_date,
+                             crc, ZIP64_LIMIT if zip64 else size, ZIP64_LIMIT if zip64 else size,
+                             len(name), len(extra)) + name + extra
+        self.offset += len(header) + size
+        return header
+
+    def add_bytes(self, arcname, data):
+        return self._local_header(arcname, zlib.crc32(data), len(data), time.time()) + data
+
+    def add_file(self, path, arcname):
+        size = os.path.getsize(path)
+        yield self._local_header(arcname, file_crc32(path), size, os.path.getmtime(path))
+        with open(path, 'rb') as f:
+            remaining = size
+            while remaining > 0:
+                chunk = f.read(min(remaining, 1024 * 1024))
+                if not chunk: raise IOError(f"File truncated while streaming: {path}")
+                remaining -= len(chunk)
+                yield chunk
+
+    def finish(self):
+        """セントラルディレクトリと終端レコード (必要なら ZIP64)"""
+        out = []
+        cd_start = self.offset
+        for name, crc, size, offset, dos_time, dos_date in self.entries:
+            values = [size, size] if size >= ZIP64_LIMIT else []
+            if offset >= ZIP64_LIMIT: values.append(offset)
+            extra = struct.pack(f'<HH{len(values)}Q', 1, 8 * len(values), *values) if values else b''
+            out.append(struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, 0x0300 | 45, 45 if values else 20, 0x800, 0,
+                                   dos_time, dos_date, crc, min(size, ZIP64_LIMIT), min(size, ZIP64_LIMIT),
+                                   len(name), len(extra), 0, 0, 0, 0o100644 << 16, min(offset, ZIP64_LIMIT)))
+            out.append(name + extra)
+        cd_size = sum(len(b) for b in out)
+        count = len(self.entries)
+        if count >= 0xFFFF or cd_start >= ZIP64_LIMIT or cd_size >= ZIP64_LIMIT:
+            zip64_end = cd_start + cd_size
+            out.append(struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 0x0300 | 45, 45, 0, 0, count, count, cd_size, cd_start))
+            out.append(struct.pack('<IIQI', 0x07064b50, 0, zip64_end, 1))
+        out.append(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                               min(cd_size, ZIP64_LIMIT), min(cd_start, ZIP64_LIMIT), 0))
+        return b''.join(out)
+
+def zip_safe_name(name):
+    name = ''.join('_' if c in '\\/:*?"<>|' or ord(c) < 32 else c for c in str(name or '')).strip(' .')
+    return name[:120] or 'untitled'
+
+def zip_album_entries(zs, album, prefix=''):
+    """アルバム 1 枚分 (ジャケット・曲・album.json・playlist.m3u8) のチャンクを yield する"""
+    meta = {k: album.get(k) for k in ('id', 'title', 'artist_name', 'year', 'type', 'spotify_id') if album.get(k)}
+    meta['tracks'] = []
+    used = set()
+
+    if album.get('cover_image'):
+        cover = resolve_storage_path(app.config['IMAGES_FOLDER'], album['cover_image'])
+        if os.path.exists(cover):
+            meta['cover'] = 'cover.' + album['cover_image'].rsplit('.', 1)[-1]
+            yield from zs.add_file(cover, prefix + meta['cover'])
+
+    for track in album['tracks']:
+        if track.get('status') != 'completed' or not track.get('filename'): continue
+        path = resolve_storage_path(app.config['MUSIC_FOLDER'], track['filename'])
+        if not os.path.exists(path): continue
+        name = f"{int(track.get('track_number', 0)):02d} - {zip_safe_name(track.get('title'))}"
+        if name in used: name = f"{name} ({track['id'][:8]})"
+        used.add(name)
+        meta['tracks'].append({"track_number": track.get('track_number'), "title": track.get('title'),
+                               "file": f"{name}.mp3", "source_type": track.get('source_type'),
+                               "original_url": track.get('original_url')})
+        yield from zs.add_file(path, f"{prefix}{name}.mp3")
+
+    yield zs.add_bytes(prefix + 'album.json', json.dumps(meta, indent=4, ensure_ascii=False).encode('utf-8'))
+    playlist = ['#EXTM3U'] + [f"#EXTINF:-1,{t['title']}\n{t['file']}" for t in meta['tracks']]
+    yield zs.add_bytes(prefix + 'playlist.m3u8', ('\n'.join(playlist) + '\n').encode('utf-8'))
+
+def zip_response(filename, generate):
+    def body():
+        zs = ZipStream()
+        yield from generate(zs)
+        yield zs.finish()
+    fallback = filename.encode('ascii', 'ignore').decode() or 'download.zip'
+    disposition = f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"
+    return Response(body(), mimetype='application/zip', headers={'Content-Disposition': disposition})
+
+@app.route('/api/album/<album_id>/zip')
+def api_download_album_zip(album_id):
+    album = load_album(album_id)
+    if not album: return json_response({"error": "Album not found"}, 404)
+    name = zip_safe_name(f"{album.get('artist_name') or ''} - {album.get('title')}".strip(' -'))
+    return zip_response(f"{name}.zip", lambda zs: zip_album_entries(zs, album))
+
+@app.route('/api/artist/<artist_id>/zip')
+def api_download_artist_zip(artist_id):
+    artist = load_artist(artist_id)
+    if not artist: return json_response({"error": "Artist not found"}, 404)
+
+    def generate(zs):
+        meta = {k: artist.get(k) for k in ('id', 'name', 'genre', 'description', 'spotify_id') if artist.get(k)}
+        meta['albums'] = []
+        if artist.get('image'):
+            image = resolve_storage_path(app.config['IMAGES_FOLDER'], artist['image'])
+            if os.path.exists(image):
+                meta['image'] = 'artist.' + artist['image'].rsplit('.', 1)[-1]
+                yield from zs.add_file(image, meta['image'])
+        used = set()
+        for summary in artist['albums']:
+            album = load_album(summary['id'])
+            if not album: continue
+            folder = zip_safe_name(f"{album.get('year') or ''} - {album.get('title')}".strip(' -'))
+            if folder in used: folder = f"{folder} ({album['id'][:8]})"
+            used.add(folder)
+            meta['albums'].append({"title": album.get('title'), "year": album.get('year'), "folder": folder})
+            yield from zip_album_entries(zs, album, prefix=f"{folder}/")
+        yield zs.add_bytes('artist.json', json.dumps(meta, indent=4, ensure_ascii=False).encode('utf-8'))
+
+    return zip_response(f"{zip_safe_name(artist['name'])}.zip", generate)
 
 # --- Admin Routes ---
 
@@ -656,19 +1428,29 @@ def admin_add_artist():
 def admin_import_artist():
     url = request.form.get('url')
     if not url: return "URLが必要です", 400
-    t = threading.Thread(target=background_artist_import_process, args=(url,))
-    t.start()
+    start_job('artist_import', url)
     return redirect(url_for('admin_index'))
 
+@app.route('/admin/artist/<artist_id>/sync', methods=['POST'])
+@requires_auth
+def admin_sync_artist(artist_id):
+    a = load_artist(artist_id)
+    if not a: return "Not found", 404
+    url = request.form.get('url') or None
+    if not a.get('spotify_id') and not url: return "SpotifyのアーティストURLが必要です", 400
+    start_job('artist_sync', artist_id, url)
+    return redirect(url_for('admin_view_artist', artist_id=artist_id))
+
 @app.route('/admin/artist/<artist_id>/edit', methods=['POST'])
 @requires_auth
 def admin_edit_artist(artist_id):
-    a = load_artist(artist_id)
-    if a:
-        a['name'] = request.form['name']; a['genre'] = request.form['genre']; a['description'] = request.form['description']
-        img = save_image_file(request.files.get('image'))
-        if img: a['image'] = img
-        save_artist(a)
+    img = save_image_file(request.files.get('image'))
+    with entity_lock('artist', artist_id):
+        a = load_artist(artist_id)
+        if a:
+            a['name'] = request.form['name']; a['genre'] = request.form['genre']; a['description'] = request.form['description']
+            if img: a['image'] = img
+            save_artist(a)
     return redirect(url_for('admin_index'))
 
 @app.route('/admin/artist/<artist_id>/delete', methods=['POST'])
@@ -687,10 +1469,11 @@ def admin_view_artist(artist_id):
 @app.route('/admin/artist/<artist_id>/album/add', methods=['POST'])
 @requires_auth
 def admin_add_album(artist_id):
-    a = load_artist(artist_id)
-    if a:
+    img = save_image_file(request.files.get('image'))
+    with entity_lock('artist', artist_id):
+        a = load_artist(artist_id)
+        if not a: return redirect(url_for('admin_view_artist', artist_id=artist_id))
         aid = str(uuid.uuid4())
-        img = save_image_file(request.files.get('image'))
         a['albums'].append({"id": aid, "title": request.form['title'], "year": request.form.get('year',''), "type": request.form.get('type','Album'), "cover_image": img})
         save_artist(a)
         save_album({"id": aid, "artist_id": artist_id, "artist_name": a['name'], "title": request.form['title'], "year": request.form.get('year',''), "type": request.form.get('type','Album'), "cover_image": img, "tracks": []})
@@ -699,18 +1482,19 @@ def admin_add_album(artist_id):
 @app.route('/admin/artist/<artist_id>/album/<album_id>/edit', methods=['POST'])
 @requires_auth
 def admin_edit_album(artist_id, album_id):
-    a = load_artist(artist_id); alb = load_album(album_id)
-    if a and alb:
-        t, y, tp = request.form['title'], request.form['year'], request.form['type']
-        img = save_image_file(request.files.get('image'))
-        for r in a['albums']:
-            if r['id'] == album_id:
-                r['title'] = t; r['year'] = y; r['type'] = tp
-                if img: r['cover_image'] = img
-        save_artist(a)
-        alb['title'] = t; alb['year'] = y; alb['type'] = tp
-        if img: alb['cover_image'] = img
-        save_album(alb)
+    img = save_image_file(request.files.get('image'))
+    with entity_lock('artist', artist_id), entity_lock('album', album_id):
+        a = load_artist(artist_id); alb = load_album(album_id)
+        if a and alb:
+            t, y, tp = request.form['title'], request.form['year'], request.form['type']
+            for r in a['albums']:
+                if r['id'] == album_id:
+                    r['title'] = t; r['year'] = y; r['type'] = tp
+                    if img: r['cover_image'] = img
+            save_artist(a)
+            alb['title'] = t; alb['year'] = y; alb['type'] = tp
+            if img: alb['cover_image'] = img
+            save_album(alb)
     return redirect(url_for('admin_view_artist', artist_id=artist_id))
 
 @app.route('/admin/artist/<artist_id>/album/<album_id>/delete', methods=['POST'])
@@ -732,16 +1516,21 @@ def admin_add_track(artist_id, album_id):
     if 'file' not in request.files: return "No file", 400
     file = request.files['file']
     if not file.filename: return "No filename", 400
-    fname = process_upload_file(file)
-    if not fname: return "Error", 500
-    alb = load_album(album_id)
-    if alb:
+    upload_id = stage_upload_file(file)
+    tid = str(uuid.uuid4())
+    def add_track(alb):
         tn = request.form.get('track_number') or len(alb['tracks']) + 1
         alb['tracks'].append({
-            "id": str(uuid.uuid4()), "title": request.form.get('title') or file.filename,
-            "track_number": int(tn), "filename": fname, "status": "completed", "source_type": "upload"
+            "id": tid, "title": f"【変換中】 {request.form.get('title') or file.filename}",
+            "track_number": int(tn), "filename": None, "processing": True, "status": "pending", "source_type": "upload"
         })
-        save_album(alb)
+    if not update_album(album_id, add_track):
+        delete_chunked_upload(upload_id)
+        return "Error", 404
+    def rollback():
+        remove_track(album_id, tid)
+        delete_chunked_upload(upload_id)
+    if not queue_upload_job(album_id, tid, upload_id, rollback): return "変換ジョブを登録できませんでした", 503
     return redirect(url_for('admin_view_album', artist_id=artist_id, album_id=album_id))
 
 @app.route('/admin/artist/<artist_id>/album/<album_id>/track/add_url', methods=['POST'])
@@ -749,20 +1538,181 @@ def admin_add_track(artist_id, album_id):
 def admin_add_track_url(artist_id, album_id):
     url = request.form.get('url')
     source = request.form.get('source', 'youtube')
-    alb = load_album(album_id)
-    if not alb: return "Error", 404
-    tn = int(request.form.get('track_number') or len(alb['tracks']) + 1)
     tid = str(uuid.uuid4())
-    alb['tracks'].append({
-        "id": tid, "title": "初期化中...", "track_number": tn, "filename": None,
-        "processing": True, "status": "pending", "source_type": source, "original_url": url
-    })
-    save_album(alb)
-    if source == 'spotify':
-        t = threading.Thread(target=background_spotify_process, args=(album_id, url, tid, tn))
-    else:
-        t = threading.Thread(target=background_youtube_process, args=(album_id, url, tid, tn))
-    t.start()
+    with entity_lock('album', album_id):
+        alb = load_album(album_id)
+        if not alb: return "Error", 404
+        tn = int(request.form.get('track_number') or len(alb['tracks']) + 1)
+        alb['tracks'].append({
+            "id": tid, "title": "初期化中...", "track_number": tn, "filename": None,
+            "processing": True, "status": "pending", "source_type": source, "original_url": url
+        })
+        save_album(alb)
+    start_job('spotify' if source == 'spotify' else 'youtube', album_id, url, tid, tn)
+    return redirect(url_for('admin_view_album', artist_id=artist_id, album_id=album_id))
+
+# --- 分割アップロード (再開可能) ---
+# 1. POST   /admin/upload            Upload-Length (と Upload-Metadata: filename <base64>) -> 201 + Location
+# 2. HEAD   /admin/upload/<id>       -> Upload-Offset (中断後はここから再開)
+# 3. PATCH  /admin/upload/<id>       Upload-Offset + application/offset+octet-stream の本文を追記
+# 4. POST   .../track/add_upload または .../track/<track_id>/replace/upload (upload_id) で確定
+
+TUS_HEADERS = {'Tus-Resumable': '1.0.0', 'Cache-Control': 'no-store'}
+
+def parse_upload_metadata(header):
+    meta = {}
+    for pair in (header or '').split(','):
+        key, _, value = pair.strip().partition(' ')
+        if key:
+            try: meta[key] = base64.b64decode(value).decode('utf-8') if value else ''
+            except Exception: meta[key] = ''
+    return meta
+
+@app.route('/admin/upload', methods=['POST'])
+@requires_auth
+def admin_create_upload():
+    try: length = int(request.headers.get('Upload-Length', ''))
+    except ValueError: return "Upload-Length が必要です", 400, TUS_HEADERS
+    meta = parse_upload_metadata(request.headers.get('Upload-Metadata'))
+    filename = meta.get('filename') or request.args.get('filename') or ''
+    if length < 0 or not allowed_audio(filename): return "対応していないファイルです", 400, TUS_HEADERS
+
+    upload_id = uuid.uuid4().hex
+    part_path, info_path = chunked_upload_paths(upload_id)
+    open(part_path, 'wb').close()
+    write_json_atomic(info_path, {"id": upload_id, "length": length, "filename": filename, "created": time.time()})
+    headers = dict(TUS_HEADERS, **{'Location': url_for('admin_upload_chunk', upload_id=upload_id), 'Upload-Offset': '0'})
+    return "", 201, headers
+
+@app.route('/admin/upload/<upload_id>', methods=['HEAD', 'PATCH', 'DELETE'])
+@requires_auth
+def admin_upload_chunk(upload_id):
+    with entity_lock('upload', upload_id):
+        info = load_chunked_upload(upload_id)
+        if not info: return "", 404, TUS_HEADERS
+        if request.method == 'DELETE':
+            delete_chunked_upload(upload_id)
+            return "", 204, TUS_HEADERS
+        headers = dict(TUS_HEADERS, **{'Upload-Length': str(info['length'])})
+        if request.method == 'HEAD':
+            return "", 200, dict(headers, **{'Upload-Offset': str(info['offset'])})
+        if info.get('finalized'): return "確定済みのアップロードです", 409, headers
+        if request.mimetype != 'application/offset+octet-stream': return "", 415, headers
+
+    # 本文の受信中は upload ロック (ストライプ共有) を持たず、.part ファイル自体を非ブロッキングでロックする。
+    # 切断された PATCH がまだ残っていても HEAD はすぐ返り、重複した PATCH は 423 で弾く。
+    part_path, _ = chunked_upload_paths(upload_id)
+    try: f = open(part_path, 'r+b', buffering=0)  # HEAD が書き込み済みのバイト数を返せるよう、バッファしない
+    except FileNotFoundError: return "", 404, TUS_HEADERS
+    with f:
+        if fcntl:
+            try: fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError: return "他の PATCH を受信中です", 423, headers
+        with entity_lock('upload', upload_id):
+            info = load_chunked_upload(upload_id)
+            if not info: return "", 404, TUS_HEADERS
+            if info.get('finalized'): return "確定済みのアップロードです", 409, headers
+            if request.headers.get('Upload-Offset') != str(info['offset']):
+                return "", 409, dict(headers, **{'Upload-Offset': str(info['offset'])})
+
+        offset = info['offset']
+        f.seek(offset)
+        try:
+            while True:
+                chunk = request.stream.read(1024 * 1024)
+                if not chunk: break
+                if offset + len(chunk) > info['length']:
+                    f.truncate(offset)
+                    return "Upload-Length を超えています", 413, dict(headers, **{'Upload-Offset': str(offset)})
+                f.write(chunk)
+                offset += len(chunk)
+        except Exception as e:
+            # 途中で切断されても書けた分は残す (HEAD で確認して再開できる)
+            logging.warning(f"Upload interrupted: {upload_id} at {offset} ({e})")
+    return "", 204, dict(headers, **{'Upload-Offset': str(offset)})
+
+def claim_completed_upload(upload_id):
+    """全バイト受信済みのアップロードを確定済みにして情報を返す (未完了/確定済みなら None)。upload ロック下で呼ぶ"""
+    info = load_chunked_upload(upload_id)
+    if not info or info.get('finalized') or info['offset'] != info['length']: return None
+    info['finalized'] = True
+    write_json_atomic(chunked_upload_paths(upload_id)[1], {k: v for k, v in info.items() if k != 'offset'})
+    return info
+
+def release_upload_claim(upload_id, info):
+    """確定後にアルバム/トラックが見つからなかった場合、確定を取り消して再試行できるようにする"""
+    info = {k: v for k, v in info.items() if k not in ('offset', 'finalized')}
+    write_json_atomic(chunked_upload_paths(upload_id)[1], info)
+
+def mark_track_converting(album_id, track_id):
+    """差し替え用: トラックを変換中にして、元に戻すための変更前の値を返す (トラックが無ければ None)"""
+    previous = {}
+    def mark_pending(target):
+        previous.update({k: target.get(k) for k in ('status', 'processing', 'title')})
+        target['status'] = 'pending'
+        target['processing'] = True
+        target['title'] = f"【変換中】 {target.get('title', '').replace('【エラー】 ', '').replace('【変換中】 ', '')}"
+    if not update_track(album_id, track_id, mark_pending): return None
+    return previous
+
+def restore_track(album_id, track_id, previous):
+    def restore(target):
+        for k, v in previous.items():
+            if v is None: target.pop(k, None)
+            else: target[k] = v
+    update_track(album_id, track_id, restore)
+
+def remove_track(album_id, track_id):
+    update_album(album_id, lambda alb: alb.update(tracks=[t for t in alb['tracks'] if t['id'] != track_id]))
+
+def queue_upload_job(album_id, track_id, upload_id, rollback):
+    """変換ジョブを積む。積めなかった場合 (キューのロック待ちのタイムアウト等) は rollback() でトラックとアップロードを戻す"""
+    try:
+        start_job('upload', album_id, track_id, upload_id)
+        return True
+    except Exception as e:
+        logging.error(f"Failed to queue upload job ({upload_id}): {e}")
+        rollback()
+        return False
+
+@app.route('/admin/artist/<artist_id>/album/<album_id>/track/add_upload', methods=['POST'])
+@requires_auth
+def admin_add_track_upload(artist_id, album_id):
+    upload_id = request.form.get('upload_id')
+    with entity_lock('upload', upload_id):
+        info = claim_completed_upload(upload_id)
+        if not info: return "アップロードが完了していません", 409
+        tid = str(uuid.uuid4())
+        def add_track(alb):
+            tn = request.form.get('track_number') or len(alb['tracks']) + 1
+            alb['tracks'].append({
+                "id": tid, "title": f"【変換中】 {request.form.get('title') or info['filename']}",
+                "track_number": int(tn), "filename": None, "processing": True, "status": "pending", "source_type": "upload"
+            })
+        if not update_album(album_id, add_track):
+            release_upload_claim(upload_id, info)
+            return "Error", 404
+        def rollback():
+            remove_track(album_id, tid)
+            release_upload_claim(upload_id, info)
+        if not queue_upload_job(album_id, tid, upload_id, rollback): return "変換ジョブを登録できませんでした", 503
+    return redirect(url_for('admin_view_album', artist_id=artist_id, album_id=album_id))
+
+@app.route('/admin/artist/<artist_id>/album/<album_id>/track/<track_id>/replace/upload', methods=['POST'])
+@requires_auth
+def admin_replace_track_upload(artist_id, album_id, track_id):
+    upload_id = request.form.get('upload_id')
+    with entity_lock('upload', upload_id):
+        info = claim_completed_upload(upload_id)
+        if not info: return "アップロードが完了していません", 409
+        previous = mark_track_converting(album_id, track_id)
+        if previous is None:
+            release_upload_claim(upload_id, info)
+            return "Track not found", 404
+        def rollback():
+            restore_track(album_id, track_id, previous)
+            release_upload_claim(upload_id, info)
+        if not queue_upload_job(album_id, track_id, upload_id, rollback): return "変換ジョブを登録できませんでした", 503
     return redirect(url_for('admin_view_album', artist_id=artist_id, album_id=album_id))
 
 # --- 音声差し替え: ファイルアップロード ---
@@ -772,30 +1722,17 @@ def admin_replace_track_file(artist_id, album_id, track_id):
     if 'file' not in request.files: return "No file", 400
     file = request.files['file']
     if not file.filename: return "No filename", 400
-    
-    # アップロードと変換
-    new_filename = process_upload_file(file)
-    if not new_filename: return "Convert Error", 500
-
-    alb = load_album(album_id)
-    if alb:
-        target = next((t for t in alb['tracks'] if t['id'] == track_id), None)
-        if target:
-            # 古いファイルの削除
-            if target.get('filename'):
-                old_path = os.path.join(app.config['MUSIC_FOLDER'], target['filename'])
-                if os.path.exists(old_path): os.remove(old_path)
-            
-            # データ更新
-            target['filename'] = new_filename
-            target['status'] = 'completed'
-            target['source_type'] = 'upload'
-            # エラー等クリア
-            if 'processing' in target: del target['processing']
-            if 'error_msg' in target: del target['error_msg']
-            
-            save_album(alb)
-            logging.info(f"Replace File Success: {target['title']}")
+
+    # 保存だけして変換はジョブに任せる (古いファイルの削除・データ更新も変換完了時に行う)
+    upload_id = stage_upload_file(file)
+    previous = mark_track_converting(album_id, track_id)
+    if previous is None:
+        delete_chunked_upload(upload_id)
+        return "Track not found", 404
+    def rollback():
+        restore_track(album_id, track_id, previous)
+        delete_chunked_upload(upload_id)
+    if not queue_upload_job(album_id, track_id, upload_id, rollback): return "変換ジョブを登録できませんでした", 503
 
     return redirect(url_for('admin_view_album', artist_id=artist_id, album_id=album_id))
 
@@ -806,75 +1743,69 @@ def admin_replace_track_url(artist_id, album_id, track_id):
     url = request.form.get('url')
     source = request.form.get('source', 'youtube')
     
-    alb = load_album(album_id)
-    if alb:
-        target = next((t for t in alb['tracks'] if t['id'] == track_id), None)
-        if target:
-            target['status'] = 'pending'
-            target['processing'] = True
-            target['title'] = f"【差し替え中】 {target.get('title', '').replace('【エラー】 ', '').replace('【差し替え中】 ', '')}"
-            save_album(alb)
-            
-            t = threading.Thread(target=background_replace_process, args=(album_id, track_id, url, source))
-            t.start()
+    def mark_pending(target):
+        target['status'] = 'pending'
+        target['processing'] = True
+        target['title'] = f"【差し替え中】 {target.get('title', '').replace('【エラー】 ', '').replace('【差し替え中】 ', '')}"
+
+    if update_track(album_id, track_id, mark_pending):
+        start_job('replace', album_id, track_id, url, source)
 
     return redirect(url_for('admin_view_album', artist_id=artist_id, album_id=album_id))
 
 @app.route('/admin/artist/<artist_id>/album/<album_id>/track/<track_id>/retry', methods=['POST'])
 @requires_auth
 def admin_retry_track(artist_id, album_id, track_id):
-    alb = load_album(album_id)
-    if not alb: return "Error", 404
-    target = next((t for t in alb['tracks'] if t['id'] == track_id), None)
-    if not target: return "Track not found", 404
-    if target.get('status') == 'error':
-        target['status'] = 'pending'; target['processing'] = True
-        target['title'] = f"【再試行中】 {target.get('title', '').replace('【エラー】 ', '')}"
-        save_album(alb)
+    with entity_lock('album', album_id):
+        alb = load_album(album_id)
+        if not alb: return "Error", 404
+        target = find_track(alb, track_id)
+        if not target: return "Track not found", 404
+        retry = target.get('status') == 'error'
+        if retry:
+            target['status'] = 'pending'; target['processing'] = True
+            target['title'] = f"【再試行中】 {target.get('title', '').replace('【エラー】 ', '')}"
+            save_album(alb)
+    if retry:
         url = target.get('original_url'); source = target.get('source_type', 'youtube'); tn = target.get('track_number')
-        if source == 'spotify': t = threading.Thread(target=background_spotify_process, args=(album_id, url, None, tn))
-        else: t = threading.Thread(target=background_youtube_process, args=(album_id, url, None, tn))
-        t.start()
+        # 元のトラックを仮トラックとして渡し、新しいトラックで置き換える (重複させない)
+        start_job('spotify' if source == 'spotify' else 'youtube', album_id, url, target['id'], tn)
     return redirect(url_for('admin_view_album', artist_id=artist_id, album_id=album_id))
 
 @app.route('/admin/artist/<artist_id>/album/<album_id>/retry_all', methods=['POST'])
 @requires_auth
 def admin_retry_all(artist_id, album_id):
-    alb = load_album(album_id)
-    if not alb: return "Error", 404
-    error_tracks = [t for t in alb['tracks'] if t.get('status') == 'error']
+    with entity_lock('album', album_id):
+        alb = load_album(album_id)
+        if not alb: return "Error", 404
+        error_tracks = [t for t in alb['tracks'] if t.get('status') == 'error']
+        for target in error_tracks:
+            target['status'] = 'pending'; target['processing'] = True
+            target['title'] = f"【一括再試行】 {target.get('title', '').replace('【エラー】 ', '')}"
+        if error_tracks: save_album(alb)
     for target in error_tracks:
-        target['status'] = 'pending'; target['processing'] = True
-        target['title'] = f"【一括再試行】 {target.get('title', '').replace('【エラー】 ', '')}"
-        save_album(alb)
         url = target.get('original_url'); source = target.get('source_type', 'youtube'); tn = target.get('track_number')
-        if source == 'spotify': t = threading.Thread(target=background_spotify_process, args=(album_id, url, None, tn))
-        else: t = threading.Thread(target=background_youtube_process, args=(album_id, url, None, tn))
-        t.start()
-        asyncio.run(asyncio.sleep(0.5))
+        start_job('spotify' if source == 'spotify' else 'youtube', album_id, url, target['id'], tn)
+        if app.config['JOB_MODE'] != 'queue': asyncio.run(asyncio.sleep(0.5))
     return redirect(url_for('admin_view_album', artist_id=artist_id, album_id=album_id))
 
 @app.route('/admin/artist/<artist_id>/album/<album_id>/track/<track_id>/edit', methods=['POST'])
 @requires_auth
 def admin_edit_track(artist_id, album_id, track_id):
-    alb = load_album(album_id)
-    if alb:
-        t = next((x for x in alb['tracks'] if x['id'] == track_id), None)
-        if t: t['title'] = request.form['title']; t['track_number'] = int(request.form['track_number']); save_album(alb)
+    def edit(t): t['title'] = request.form['title']; t['track_number'] = int(request.form['track_number'])
+    update_track(album_id, track_id, edit)
     return redirect(url_for('admin_view_album', artist_id=artist_id, album_id=album_id))
 
 @app.route('/admin/artist/<artist_id>/album/<album_id>/track/<track_id>/delete', methods=['POST'])
 @requires_auth
 def admin_delete_track(artist_id, album_id, track_id):
-    alb = load_album(album_id)
-    if alb:
-        t = next((x for x in alb['tracks'] if x['id'] == track_id), None)
-        if t and t.get('filename'):
-            p = os.path.join(app.config['MUSIC_FOLDER'], t['filename'])
-            if os.path.exists(p): os.remove(p)
+    def delete(alb):
+        t = find_track(alb, track_id)
+        if t: remove_track_audio(t)
         alb['tracks'] = [x for x in alb['tracks'] if x['id'] != track_id]
-        save_album(alb)
+    update_album(album_id, delete)
     return redirect(url_for('admin_view_album', artist_id=artist_id, album_id=album_id))
 
 if __name__ == '__main__':
+    # 開発用。本番は wsgi.py (gunicorn) + worker.py を使う
     app.run(debug=True, host='0.0.0.0', port=5000)
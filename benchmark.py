@@ -0,0 +1,501 @@
+"""
+ベンチマーク (回帰測定用)
+
+合成カタログ (data/) を一時ディレクトリに生成し、spotDL / yt-dlp / spotipy / requests を
+ローカルの偽実装に差し替えた上で、以下を計測する。
+
+  startup : 別プロセスでの `import app` の所要時間 (偽実装なし)
+  api     : /api/* ・ /stream ・ /image のレイテンシとスループット
+  writes  : save_artist (index 書き換え込み) / save_album
+  imports : アーティスト一括インポート・YouTube プレイリスト取り込みのエンドツーエンド
+
+例:
+  python benchmark.py --artists 10000 --albums-per-artist 1 --tracks-per-album 10
+  python benchmark.py --phases api --requests 2000 --concurrency 8 --json result.json
+"""
+import os
+import sys
+import io
+import json
+import time
+import uuid
+import types
+import random
+import shutil
+import argparse
+import subprocess
+import tempfile
+import threading
+import statistics
+from pathlib import Path
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+
+# --- 偽の音声 / 画像データ ---
+
+# MPEG-1 Layer III 128kbps 44.1kHz の無音フレーム (ヘッダ + ゼロ埋め 417 bytes)
+SILENT_MP3_FRAME = b'\xff\xfb\x90\x64' + b'\x00' * 413
+FAKE_JPEG = b'\xff\xd8\xff\xe0' + b'\x00' * 512 + b'\xff\xd9'
+
+FAKE_LATENCY = 0.0
+# bench_imports は app のレート制限用 sleep (time.sleep) を無効化するので、偽実装の遅延は元の関数で待つ
+real_sleep = time.sleep
+FAKE_FRAMES = 40  # 約 1 秒
+TRACKS_PER_RELEASE = 10
+RELEASES_PER_ARTIST = 3
+
+
+def write_fake_audio(path):
+    with open(path, 'wb') as f:
+        f.write(SILENT_MP3_FRAME * FAKE_FRAMES)
+
+
+def fake_id(url):
+    return url.rstrip('/').rsplit('/', 1)[-1].split('?')[0]
+
+
+# --- 偽 spotdl ---
+
+class FakeSong:
+    def __init__(self, album_url, num):
+        self.song_id = f"{fake_id(album_url)}t{num:03d}"
+        self.name = f"Song {num}"
+        self.artist = "Bench Artist"
+        self.artists = [self.artist]
+        self.album_name = f"Album {fake_id(album_url)}"
+        self.disc_number = 1
+        self.track_number = num
+        self.url = f"https://open.spotify.com/track/{self.song_id}"
+
+
+class FakeSpotdl:
+    def __init__(self, client_id=None, client_secret=None, user_auth=False, headless=True, **kwargs):
+        self.client_id = client_id
+
+    def search(self, queries):
+        songs = []
+        for q in queries:
+            if '/track/' in q:
+                songs.append(FakeSong(q, 1))
+            else:
+                songs.extend(FakeSong(q, n) for n in range(1, TRACKS_PER_RELEASE + 1))
+        return songs
+
+
+class FakeDownloader:
+    def __init__(self, settings=None, loop=None):
+        self.settings = dict(settings or {})
+        self.loop = loop
+
+    def download_song(self, song):
+        if FAKE_LATENCY: real_sleep(FAKE_LATENCY)
+        out = (self.settings["output"]
+               .replace("{artists}", song.artist)
+               .replace("{title}", song.name)
+               .replace("{output-ext}", "mp3"))
+        os.makedirs(os.path.dirname(out), exist_ok=True)
+        write_fake_audio(out)
+        return song, Path(out)
+
+
+# --- 偽 yt_dlp ---
+
+class FakeYoutubeDL:
+    def __init__(self, opts=None):
+        self.opts = opts or {}
+
+    def __enter__(self): return self
+    def __exit__(self, *exc): return False
+
+    def extract_info(self, url, download=False):
+        if 'list=' in url and not download:
+            entries = [{"title": f"Video {n}", "url": f"https://www.youtube.com/watch?v={fake_id(url)}{n:03d}"}
+                       for n in range(1, TRACKS_PER_RELEASE + 1)]
+            return {"title": "Bench Playlist", "entries": entries}
+        info = {"title": f"Video {fake_id(url)}", "webpage_url": url}
+        if download:
+            if FAKE_LATENCY: real_sleep(FAKE_LATENCY)
+            write_fake_audio(self.opts['outtmpl'] + '.mp3')
+        return info
+
+
+# --- 偽 spotipy ---
+
+class FakeSpotify:
+    def __init__(self, auth_manager=None, **kwargs):
+        self.auth_manager = auth_manager
+
+    def artist(self, url):
+        aid = fake_id(url)
+        return {"id": aid, "name": f"Bench Artist {aid}", "genres": ["bench"],
+                "images": [{"url": f"https://i.scdn.co/image/{aid}"}]}
+
+    def artist_albums(self, url, album_type=None, limit=20, offset=0, **kwargs):
+        aid = fake_id(url)
+        items = []
+        for n in range(offset, min(offset + limit, RELEASES_PER_ARTIST)):
+            rid = f"{aid}r{n:03d}"
+            items.append({
+                "id": rid, "name": f"Release {n}", "release_date": "2024-01-01",
+                "album_type": "album", "total_tracks": TRACKS_PER_RELEASE,
+                "images": [{"url": f"https://i.scdn.co/image/{rid}"}],
+                "external_urls": {"spotify": f"https://open.spotify.com/album/{rid}"},
+            })
+        return {"items": items, "next": None}
+
+    def next(self, result):
+        return None
+
+
+class FakeClientCredentials:
+    def __init__(self, client_id=None, client_secret=None, **kwargs):
+        self.client_id = client_id
+
+
+# --- 偽 requests ---
+
+class FakeRaw(io.BytesIO):
+    decode_content = False
+
+
+class FakeHTTPResponse:
+    def __init__(self):
+        self.status_code = 200
+        self.raw = FakeRaw(FAKE_JPEG)
+
+
+def fake_requests_get(url, stream=False, **kwargs):
+    return FakeHTTPResponse()
+
+
+def install_fakes():
+    """app の import より前に sys.modules を偽実装で埋める"""
+    spotdl_mod = types.ModuleType('spotdl')
+    spotdl_mod.Spotdl = FakeSpotdl
+    spotdl_download = types.ModuleType('spotdl.download')
+    spotdl_downloader = types.ModuleType('spotdl.download.downloader')
+    spotdl_downloader.Downloader = FakeDownloader
+    spotdl_mod.download = spotdl_download
+    spotdl_download.downloader = spotdl_downloader
+
+    yt_mod = types.ModuleType('yt_dlp')
+    yt_mod.YoutubeDL = FakeYoutubeDL
+
+    spotipy_mod = types.ModuleType('spotipy')
+    spotipy_mod.Spotify = FakeSpotify
+    spotipy_oauth2 = types.ModuleType('spotipy.oauth2')
+    spotipy_oauth2.SpotifyClientCredentials = FakeClientCredentials
+    spotipy_mod.oauth2 = spotipy_oauth2
+
+    requests_mod = types.ModuleType('requests')
+    requests_mod.get = fake_requests_get
+
+    sys.modules.update({
+        'spotdl': spotdl_mod, 'spotdl.download': spotdl_download,
+        'spotdl.download.downloader': spotdl_downloader,
+        'yt_dlp': yt_mod,
+        'spotipy': spotipy_mod, 'spotipy.oauth2': spotipy_oauth2,
+        'requests': requests_mod,
+    })
+
+
+FAKE_FFMPEG = '''#!{python}
+import os, sys, shutil
+args = sys.argv[1:]
+src = args[args.index('-i') + 1]
+if 'hls' in args:
+    # 1 セグメントだけの VOD プレイリスト
+    seg = args[args.index('-hls_segment_filename') + 1] % 0
+    shutil.copyfile(src, seg)
+    with open(args[-1], 'w') as f:
+        f.write("#EXTM3U\\n#EXT-X-VERSION:3\\n#EXT-X-TARGETDURATION:10\\n#EXT-X-PLAYLIST-TYPE:VOD\\n"
+                "#EXTINF:1.0,\\n" + os.path.basename(seg) + "\\n#EXT-X-ENDLIST\\n")
+else:
+    shutil.copyfile(src, args[-1])
+'''
+
+
+def install_fake_ffmpeg(base_dir):
+    """ffmpeg が無い環境では入力をコピーするだけの偽 ffmpeg を PATH に置く"""
+    bin_dir = os.path.join(base_dir, 'bin')
+    os.makedirs(bin_dir, exist_ok=True)
+    path = os.path.join(bin_dir, 'ffmpeg')
+    with open(path, 'w') as f:
+        f.write(FAKE_FFMPEG.format(python=sys.executable))
+    os.chmod(path, 0o755)
+    os.environ['PATH'] = bin_dir + os.pathsep + os.environ.get('PATH', '')
+
+
+# --- 合成カタログ ---
+
+def generate_catalog(app_module, n_artists, albums_per_artist, tracks_per_album):
+    """data/ ・ music/ ・ images/ に合成データを書き出す (index は一括書き込み)"""
+    cfg = app_module.app.config
+    image = f"{uuid.uuid4().hex}.jpg"
+    with open(app_module.storage_path(cfg['IMAGES_FOLDER'], image, create=True), 'wb') as f: f.write(FAKE_JPEG)
+    audio = f"{uuid.uuid4().hex}.mp3"
+    write_fake_audio(app_module.storage_path(cfg['MUSIC_FOLDER'], audio, create=True))
+
+    index, artist_ids, album_ids = [], [], []
+    for a in range(n_artists):
+        artist_id = str(uuid.uuid4())
+        artist = {"id": artist_id, "name": f"Artist {a}", "genre": "bench",
+                  "description": "synthetic", "image": image, "albums": []}
+        for b in range(albums_per_artist):
+            album_id = str(uuid.uuid4())
+            artist['albums'].append({"id": album_id, "title": f"Album {a}-{b}", "year": "2024",
+                                     "type": "Album", "cover_image": image})
+            tracks = [{"id": str(uuid.uuid4()), "title": f"Track {t}", "track_number": t,
+                       "filename": audio, "status": "completed", "source_type": "upload"}
+                      for t in range(1, tracks_per_album + 1)]
+            app_module.save_album({"id": album_id, "artist_id": artist_id, "artist_name": artist['name'],
+                                   "title": f"Album {a}-{b}", "year": "2024", "type": "Album",
+                                   "cover_image": image, "tracks": tracks})
+            album_ids.append(album_id)
+        with open(os.path.join(cfg['ARTISTS_FOLDER'], f"{artist_id}.json"), 'w', encoding='utf-8') as f:
+            json.dump(artist, f, ensure_ascii=False)
+        index.append({"id": artist_id, "name": artist['name'], "genre": "bench", "description": "synthetic",
+                      "image": image, "album_count": albums_per_artist})
+        artist_ids.append(artist_id)
+    app_module.save_index(index)
+    return {"artists": artist_ids, "albums": album_ids, "audio": audio, "image": image}
+
+
+# --- 計測 ---
+
+def summarize(name, latencies, wall):
+    lat = sorted(latencies)
+    n = len(lat)
+    pick = lambda q: lat[min(n - 1, int(q * n))] * 1000 if n else 0.0
+    return {
+        "name": name, "count": n, "wall_s": round(wall, 4),
+        "ops_per_s": round(n / wall, 2) if wall else 0.0,
+        "mean_ms": round(statistics.fmean(lat) * 1000, 3) if n else 0.0,
+        "p50_ms": round(pick(0.50), 3), "p95_ms": round(pick(0.95), 3), "p99_ms": round(pick(0.99), 3),
+    }
+
+
+def run_timed(name, fn, count, concurrency=1):
+    latencies = []
+    lock = threading.Lock()
+
+    def one(i):
+        t0 = time.perf_counter()
+        fn(i)
+        dt = time.perf_counter() - t0
+        with lock: latencies.append(dt)
+
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as ex:
+            list(ex.map(one, range(count)))
+    else:
+        for i in range(count): one(i)
+    return summarize(name, latencies, time.perf_counter() - start)
+
+
+def bench_api(app_module, catalog, args):
+    client = app_module.app.test_client()
+    rnd = random.Random(args.seed)
+
+    headers = {'Accept-Encoding': args.accept_encoding} if args.accept_encoding else {}
+
+    def get(path):
+        resp = client.get(path, headers=headers)
+        if resp.status_code != 200:
+            raise RuntimeError(f"{path} -> {resp.status_code}")
+        resp.get_data()
+        resp.close()
+
+    n_list = max(1, args.requests // 20)
+    return [
+        run_timed("GET /api/artists", lambda i: get('/api/artists'), n_list, args.concurrency),
+        run_timed("GET /api/artist/<id>", lambda i: get(f"/api/artist/{rnd.choice(catalog['artists'])}"),
+                  args.requests, args.concurrency),
+        run_timed("GET /api/album/<id>", lambda i: get(f"/api/album/{rnd.choice(catalog['albums'])}"),
+                  args.requests, args.concurrency),
+        run_timed("GET /stream/<file>", lambda i: get(f"/stream/{catalog['audio']}"), args.requests, args.concurrency),
+        run_timed("GET /image/<file>", lambda i: get(f"/image/{catalog['image']}"), args.requests, args.concurrency),
+    ]
+
+
+def bench_writes(app_module, catalog, args):
+    rnd = random.Random(args.seed)
+
+    def rewrite_artist(i):
+        artist = app_module.load_artist(rnd.choice(catalog['artists']))
+        artist['description'] = f"rewrite {i}"
+        app_module.save_artist(artist)
+
+    def rewrite_album(i):
+        album = app_module.load_album(rnd.choice(catalog['albums']))
+        album['title'] = f"rewrite {i}"
+        app_module.save_album(album)
+
+    return [
+        run_timed("save_artist (+index)", rewrite_artist, args.writes),
+        run_timed("save_album", rewrite_album, args.writes),
+    ]
+
+
+def count_completed(app_module, album_ids):
+    done = total = 0
+    for album_id in album_ids:
+        album = app_module.load_album(album_id) or {"tracks": []}
+        total += len(album['tracks'])
+        done += sum(1 for t in album['tracks'] if t.get('status') == 'completed')
+    return done, total
+
+
+def bench_imports(app_module, args):
+    results = []
+    known = {a['id'] for a in app_module.load_index()}
+
+    # Spotify アーティスト一括インポート (レート制限用の sleep は偽 API なので省く)
+    start = time.perf_counter()
+    latencies = []
+    with mock.patch('time.sleep'):
+        for n in range(args.imports):
+            t0 = time.perf_counter()
+            app_module.background_artist_import_process(f"https://open.spotify.com/artist/bench{n:04d}")
+            latencies.append(time.perf_counter() - t0)
+    row = summarize("artist import (spotify)", latencies, time.perf_counter() - start)
+    new_albums = [alb['id'] for a in app_module.load_index() if a['id'] not in known
+                  for alb in (app_module.load_artist(a['id']) or {"albums": []})['albums']]
+    row['tracks_completed'], row['tracks_total'] = count_completed(app_module, new_albums)
+    row['tracks_per_s'] = round(row['tracks_completed'] / row['wall_s'], 2) if row['wall_s'] else 0.0
+    results.append(row)
+
+    # YouTube プレイリスト取り込み
+    album_ids = []
+    latencies = []
+    start = time.perf_counter()
+    for n in range(args.imports):
+        album_id = str(uuid.uuid4())
+        app_module.save_album({"id": album_id, "artist_id": None, "artist_name": "Bench", "title": f"YT {n}",
+                               "year": "", "type": "Album", "cover_image": None, "tracks": []})
+        album_ids.append(album_id)
+        t0 = time.perf_counter()
+        app_module.background_youtube_process(album_id, f"https://www.youtube.com/playlist?list=bench{n:04d}", None, 1)
+        latencies.append(time.perf_counter() - t0)
+    row = summarize("playlist import (youtube)", latencies, time.perf_counter() - start)
+    row['tracks_completed'], row['tracks_total'] = count_completed(app_module, album_ids)
+    row['tracks_per_s'] = round(row['tracks_completed'] / row['wall_s'], 2) if row['wall_s'] else 0.0
+    results.append(row)
+    return results
+
+
+HEAVY_MODULES = ('yt_dlp', 'spotdl', 'spotipy', 'requests')
+
+STARTUP_PROBE = '''
+import sys, time
+t0 = time.perf_counter()
+import app
+print(time.perf_counter() - t0)
+print(','.join(m for m in {heavy!r} if m in sys.modules))
+'''
+
+
+def bench_startup(args):
+    """新しいインタプリタで app を import する時間 (重いモジュールが読み込まれていないかも確認)"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    probe = STARTUP_PROBE.format(heavy=HEAVY_MODULES)
+    import_times, wall_times, loaded = [], [], set()
+    for _ in range(args.startup_runs):
+        t0 = time.perf_counter()
+        out = subprocess.run([sys.executable, '-c', probe], cwd=here, env=os.environ.copy(),
+                             capture_output=True, text=True, check=True).stdout.splitlines()
+        wall_times.append(time.perf_counter() - t0)
+        import_times.append(float(out[-2]))
+        loaded.update(m for m in out[-1].split(',') if m)
+    rows = [summarize("import app", import_times, sum(import_times)),
+            summarize("process start + import", wall_times, sum(wall_times))]
+    rows[0]['heavy_modules_loaded'] = sorted(loaded)
+    return rows
+
+
+def print_table(title, rows):
+    print(f"\n== {title} ==")
+    print(f"{'name':<28}{'count':>8}{'ops/s':>11}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for r in rows:
+        print(f"{r['name']:<28}{r['count']:>8}{r['ops_per_s']:>11}{r['mean_ms']:>10}"
+              f"{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}")
+        if 'heavy_modules_loaded' in r:
+            print(f"{'':<28}heavy modules loaded at import: {', '.join(r['heavy_modules_loaded']) or 'none'}")
+        if 'tracks_total' in r:
+            print(f"{'':<28}tracks {r['tracks_completed']}/{r['tracks_total']} completed, {r['tracks_per_s']} tracks/s")
+
+
+def main():
+    global FAKE_LATENCY, TRACKS_PER_RELEASE, RELEASES_PER_ARTIST
+
+    p = argparse.ArgumentParser(description="Music Server benchmark (synthetic catalog + local fakes)")
+    p.add_argument('--artists', type=int, default=1000)
+    p.add_argument('--albums-per-artist', type=int, default=3)
+    p.add_argument('--tracks-per-album', type=int, default=10)
+    p.add_argument('--requests', type=int, default=1000, help="API ルートごとのリクエスト数")
+    p.add_argument('--concurrency', type=int, default=1, help="API 計測のスレッド数")
+    p.add_argument('--accept-encoding', default='', help="API 計測で送る Accept-Encoding (例: gzip, br)")
+    p.add_argument('--writes', type=int, default=200)
+    p.add_argument('--imports', type=int, default=2, help="インポート計測の回数")
+    p.add_argument('--fake-latency', type=float, default=0.0, help="偽ダウンロード 1 曲あたりの遅延 (秒)")
+    p.add_argument('--hls', action='store_true', help="インポート時に HLS パッケージングも行う")
+    p.add_argument('--startup-runs', type=int, default=5, help="起動時間計測の回数")
+    p.add_argument('--phases', default='startup,api,writes,imports')
+    p.add_argument('--base-dir', help="データ置き場 (省略時は一時ディレクトリ)")
+    p.add_argument('--keep', action='store_true', help="終了後もデータ置き場を残す")
+    p.add_argument('--seed', type=int, default=1)
+    p.add_argument('--json', help="結果を JSON で書き出すパス")
+    args = p.parse_args()
+
+    FAKE_LATENCY = args.fake_latency
+    TRACKS_PER_RELEASE = args.tracks_per_album
+    RELEASES_PER_ARTIST = args.albums_per_artist
+
+    base_dir = args.base_dir or tempfile.mkdtemp(prefix='music_bench_')
+    os.makedirs(base_dir, exist_ok=True)
+    with open(os.path.join(base_dir, 'spotify_key.txt'), 'w', encoding='utf-8') as f:
+        f.write("bench-client-id\nbench-client-secret\n")
+    os.environ['MUSIC_SERVER_BASE_DIR'] = base_dir
+    if args.hls: os.environ['MUSIC_SERVER_HLS'] = '1'
+
+    phases = set(args.phases.split(','))
+    report = {"params": vars(args), "base_dir": base_dir, "results": {}}
+    if 'startup' in phases:
+        report['results']['startup'] = bench_startup(args)
+        print_table("startup", report['results']['startup'])
+
+    install_fakes()
+    if not shutil.which('ffmpeg'):
+        install_fake_ffmpeg(base_dir)
+
+    import logging
+    import app as app_module
+    logging.getLogger('').setLevel(logging.WARNING)
+
+    try:
+        t0 = time.perf_counter()
+        catalog = generate_catalog(app_module, args.artists, args.albums_per_artist, args.tracks_per_album)
+        print(f"catalog: {args.artists} artists / {len(catalog['albums'])} albums / "
+              f"{len(catalog['albums']) * args.tracks_per_album} tracks generated in {time.perf_counter() - t0:.2f}s "
+              f"({base_dir})")
+
+        if 'api' in phases:
+            report['results']['api'] = bench_api(app_module, catalog, args)
+            print_table("API", report['results']['api'])
+        if 'writes' in phases:
+            report['results']['writes'] = bench_writes(app_module, catalog, args)
+            print_table("catalog writes", report['results']['writes'])
+        if 'imports' in phases:
+            report['results']['imports'] = bench_imports(app_module, args)
+            print_table("end-to-end imports", report['results']['imports'])
+
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f: json.dump(report, f, indent=4, ensure_ascii=False)
+    finally:
+        if not args.keep and not args.base_dir:
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,15 @@
+# gunicorn -c gunicorn.conf.py wsgi:app
+import os
+import multiprocessing
+
+bind = os.environ.get('MUSIC_SERVER_BIND', '0.0.0.0:5000')
+
+# /stream は長時間のレスポンスになるので gthread でワーカーあたり複数接続を捌く
+workers = int(os.environ.get('MUSIC_SERVER_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('MUSIC_SERVER_THREADS', 8))
+timeout = 120
+keepalive = 5
+
+# 念のため: Web 側は必ずキューモード (ダウンロードは worker.py)
+raw_env = ['MUSIC_SERVER_JOB_MODE=queue']
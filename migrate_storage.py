@@ -0,0 +1,61 @@
+"""
+music/ ・ images/ ・ hls/ の旧フラット配置をシャード配置 (ab/cd/...) に移行する
+
+サーバー/ワーカーを止めずに実行できる。配信側はシャード配置 -> フラット配置の順に探すので、
+1 件ずつ rename (同一ファイルシステム内でアトミック) していけば途中でも 404 にならない。
+
+  python migrate_storage.py --dry-run
+  python migrate_storage.py --sleep 0.001
+"""
+import os
+import time
+import logging
+import argparse
+
+import app as server
+
+
+def migrate_folder(folder, dirs, dry_run=False, limit=None, sleep=0.0):
+    """folder 直下のエントリを移動する (dirs=True なら HLS のディレクトリ、False ならファイル)"""
+    moved = skipped = 0
+    with os.scandir(folder) as it:
+        for entry in it:
+            if limit is not None and moved >= limit: break
+            if entry.name.endswith('.tmp'): continue
+            is_target = entry.is_dir(follow_symlinks=False) if dirs else entry.is_file(follow_symlinks=False)
+            if not is_target: continue
+            if not server.shard_subdir(entry.name): continue  # シャード用ディレクトリ自身や対象外の名前
+
+            dest = server.storage_path(folder, entry.name, create=not dry_run)
+            if os.path.exists(dest):
+                logging.warning(f"Skip (already exists): {dest}")
+                skipped += 1
+                continue
+            if not dry_run:
+                os.rename(entry.path, dest)
+                if sleep: time.sleep(sleep)
+            moved += 1
+    return moved, skipped
+
+
+def main():
+    p = argparse.ArgumentParser(description="Migrate flat music/images/hls folders to the sharded layout")
+    p.add_argument('--dry-run', action='store_true', help="移動せず件数だけ数える")
+    p.add_argument('--limit', type=int, help="フォルダごとの最大移動件数")
+    p.add_argument('--sleep', type=float, default=0.0, help="1 件ごとの待機秒数 (I/O 負荷の調整)")
+    args = p.parse_args()
+
+    targets = [
+        (server.app.config['MUSIC_FOLDER'], False),
+        (server.app.config['IMAGES_FOLDER'], False),
+        (server.app.config['HLS_FOLDER'], True),
+    ]
+    for folder, dirs in targets:
+        if not os.path.isdir(folder): continue
+        moved, skipped = migrate_folder(folder, dirs, args.dry_run, args.limit, args.sleep)
+        verb = "would move" if args.dry_run else "moved"
+        logging.info(f"{folder}: {verb} {moved}, skipped {skipped}")
+
+
+if __name__ == '__main__':
+    main()
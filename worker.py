@@ -0,0 +1,144 @@
+"""
+ダウンロード/変換ワーカー (本番用)
+
+wsgi.py (JOB_MODE=queue) が data/jobs.sqlite3 に積んだジョブを取り出して実行する。
+Web プロセスとは別プロセスで動かすので、重いインポート中もストリーミングや API の応答に影響しない。
+
+  python worker.py --threads 2
+  python worker.py --sync-interval 24   # Spotify 連携済みアーティストの新作を 24 時間ごとに同期
+"""
+import os
+import json
+import time
+import signal
+import socket
+import logging
+import argparse
+import threading
+
+os.environ.setdefault('MUSIC_SERVER_JOB_MODE', 'queue')
+
+import app as server  # noqa: E402
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def requeue_orphans(conn):
+    """このホストで落ちたワーカーが running のまま残したジョブを pending に戻す (各ハンドラは再実行しても曲が重複しない)"""
+    host = socket.gethostname()
+    rows = conn.execute("SELECT id, worker FROM jobs WHERE status = 'running'").fetchall()
+    for row in rows:
+        w_host, _, w_pid = (row['worker'] or '').rpartition(':')
+        if w_host == host and w_pid.isdigit() and not pid_alive(int(w_pid)):
+            conn.execute("UPDATE jobs SET status = 'pending', worker = NULL WHERE id = ? AND status = 'running'",
+                         (row['id'],))
+            logging.warning(f"Requeued orphaned job #{row['id']}")
+
+
+def purge_finished(conn, keep_days):
+    conn.execute("DELETE FROM jobs WHERE status IN ('done', 'error') AND finished_at < ?",
+                 (time.time() - keep_days * 86400,))
+
+
+def housekeeping(stop, keep_days, upload_expire_hours):
+    """古い完了ジョブと放置された分割アップロードを 1 時間ごとに片付ける"""
+    while not stop.is_set():
+        conn = server.job_db()
+        try:
+            purge_finished(conn, keep_days)
+            removed = server.expire_chunked_uploads(upload_expire_hours)
+            if removed: logging.info(f"Expired {removed} stale chunked uploads")
+        except Exception as e:
+            logging.error(f"Housekeeping failed: {e}")
+        finally:
+            conn.close()
+        stop.wait(3600)
+
+
+def schedule_artist_syncs(stop, interval_hours):
+    """spotify_id を持つ全アーティストの差分同期ジョブを定期的に積む (同じアーティストの未処理ジョブがあれば積まない)"""
+    while not stop.is_set():
+        conn = server.job_db()
+        try:
+            queued = {tuple(json.loads(row['args'])[:1]) for row in conn.execute(
+                "SELECT args FROM jobs WHERE kind = 'artist_sync' AND status IN ('pending', 'running')")}
+            count = 0
+            for summary in server.load_index():
+                if summary.get('spotify_id') and (summary['id'],) not in queued:
+                    server.start_job('artist_sync', summary['id'], None)
+                    count += 1
+            logging.info(f"Scheduled artist sync: {count} artists")
+        except Exception as e:
+            logging.error(f"Artist sync scheduling failed: {e}")
+        finally:
+            conn.close()
+        stop.wait(interval_hours * 3600)
+
+
+def worker_loop(stop, poll_interval):
+    name = f"{socket.gethostname()}:{os.getpid()}"
+    conn = server.job_db()
+    try:
+        while not stop.is_set():
+            row = server.claim_job(conn, name)
+            if not row:
+                stop.wait(poll_interval)
+                continue
+            logging.info(f"Job #{row['id']} start: {row['kind']} {row['args']}")
+            try:
+                server.run_job(row)
+                server.finish_job(conn, row['id'])
+                logging.info(f"Job #{row['id']} done")
+            except Exception as e:
+                logging.error(f"Job #{row['id']} failed: {e}")
+                server.finish_job(conn, row['id'], str(e))
+    finally:
+        conn.close()
+
+
+def main():
+    p = argparse.ArgumentParser(description="Music Server ingestion worker")
+    p.add_argument('--threads', type=int, default=int(os.environ.get('MUSIC_SERVER_WORKER_THREADS', 2)),
+                   help="同時に処理するジョブ数")
+    p.add_argument('--poll', type=float, default=1.0, help="キューが空のときの待機秒数")
+    p.add_argument('--keep-days', type=float, default=7, help="完了ジョブを残す日数")
+    p.add_argument('--upload-expire-hours', type=float, default=24, help="未完了の分割アップロードを残す時間")
+    p.add_argument('--sync-interval', type=float, default=float(os.environ.get('MUSIC_SERVER_SYNC_INTERVAL', 0)),
+                   help="アーティスト新作同期の間隔 (時間)。0 なら定期同期しない")
+    args = p.parse_args()
+
+    conn = server.job_db()
+    try:
+        requeue_orphans(conn)
+    finally:
+        conn.close()
+
+    stop = threading.Event()
+    def shutdown(signum, frame):
+        logging.info("Worker stopping (waiting for running jobs)...")
+        stop.set()
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    threads = [threading.Thread(target=worker_loop, args=(stop, args.poll), name=f"job-worker-{i}")
+               for i in range(args.threads)]
+    threads.append(threading.Thread(target=housekeeping, args=(stop, args.keep_days, args.upload_expire_hours),
+                                    name="housekeeping"))
+    if args.sync_interval > 0:
+        threads.append(threading.Thread(target=schedule_artist_syncs, args=(stop, args.sync_interval),
+                                        name="artist-sync-scheduler"))
+    for t in threads: t.start()
+    logging.info(f"Worker started: {args.threads} threads")
+    for t in threads: t.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,14 @@
+"""
+本番用エントリポイント
+
+Web プロセスはダウンロード/変換を行わず、ジョブを data/jobs.sqlite3 に積むだけにする。
+ジョブは別プロセスの worker.py が処理する。
+
+  gunicorn -c gunicorn.conf.py wsgi:app
+  python worker.py
+"""
+import os
+
+os.environ.setdefault('MUSIC_SERVER_JOB_MODE', 'queue')
+
+from app import app  # noqa: E402